@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.crypto import salted_hmac
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
+                                                 InvalidToken)
+from rest_framework_simplejwt.settings import api_settings
+
+from .cache import AUTH_USER_KEY
+
+User = get_user_model()
+
+PASSWORD_CLAIM = 'pwd'
+# Поля пользователя в кэше аутентификации: профиль для сериализаторов
+# и флаги для проверки прав. Хэш пароля в кэш не попадает.
+AUTH_USER_FIELDS = frozenset((
+    'id', 'is_active', 'is_staff', 'is_superuser',
+    'email', 'username', 'first_name', 'last_name',
+))
+
+
+def get_password_fingerprint(user):
+    """Отпечаток хэша пароля: меняется вместе с паролем."""
+    return salted_hmac(
+        'api.authentication.password', user.password).hexdigest()[:16]
+
+
+def get_auth_user(user_id):
+    """
+    Пользователь для аутентификации по JWT с отпечатком пароля
+    в атрибуте password_fingerprint. Кэшируются только поля
+    AUTH_USER_FIELDS и отпечаток, на JWT_USER_CACHE_TIMEOUT секунд,
+    0 отключает кэш. Остальные поля загружаются из базы при
+    обращении, а save() сохраняет только загруженные поля.
+    """
+    field_names = [field.attname for field in User._meta.concrete_fields
+                   if field.attname in AUTH_USER_FIELDS]
+
+    def load():
+        user = User.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        return ([getattr(user, name) for name in field_names],
+                get_password_fingerprint(user))
+
+    if settings.JWT_USER_CACHE_TIMEOUT:
+        cached = cache.get_or_set(AUTH_USER_KEY.format(user_id), load,
+                                  settings.JWT_USER_CACHE_TIMEOUT)
+    else:
+        cached = load()
+    if cached is None:
+        return None
+    values, fingerprint = cached
+    user = User.from_db(DEFAULT_DB_ALIAS, field_names, values)
+    user.password_fingerprint = fingerprint
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    Аутентификация по JWT без запроса к базе на каждый запрос:
+    пользователь берётся из кэша get_auth_user. Токены, выданные
+    до смены пароля, отклоняются по отпечатку пароля.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Токен не содержит идентификатор пользователя')
+        user = get_auth_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(
+                'Пользователь не найден', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(
+                'Пользователь не активен', code='user_inactive')
+        if validated_token.get(PASSWORD_CLAIM) != user.password_fingerprint:
+            raise AuthenticationFailed(
+                'Пароль изменён, войдите заново', code='password_changed')
+        return user
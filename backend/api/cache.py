@@ -0,0 +1,216 @@
+import hashlib
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+from recipes.models import CatalogueVersion, Favorite, ShoppingCart, Tag
+from users.models import Subscribe
+
+User = get_user_model()
+
+SHOPPING_CART_VERSION_KEY = 'shopping_cart_version:{}'
+SHOPPING_CART_KEY = 'shopping_cart:{}:{}'
+CATALOGUE_VERSION_KEY = 'catalogue_version'
+CATALOGUE_KEY = 'catalogue:{}:{}'
+TAG_IDS_KEY = 'tag_ids:{}'
+RECIPE_VERSION_KEY = 'recipe_version:{}'
+AUTHOR_VERSION_KEY = 'author_version:{}'
+RECIPE_FRAGMENT_KEY = 'recipe_fragment:{}:{}:{}:{}:{}:{}'
+USER_RELATIONS_KEY = 'user_relations:{}'
+AUTH_USER_KEY = 'auth_user:{}'
+
+UserRelations = namedtuple(
+    'UserRelations', ('favorites', 'shopping_cart', 'subscriptions'))
+NO_RELATIONS = UserRelations(frozenset(), frozenset(), frozenset())
+
+
+def get_shopping_cart_key(user_id):
+    """Ключ кэша списка покупок для текущей версии корзины."""
+    version = cache.get_or_set(
+        SHOPPING_CART_VERSION_KEY.format(user_id), time.time_ns, None)
+    return SHOPPING_CART_KEY.format(user_id, version)
+
+
+def bump_shopping_cart_version(*user_ids):
+    """Меняет версию корзины, делая устаревшим закэшированный список."""
+    version = time.time_ns()
+    cache.set_many(
+        {SHOPPING_CART_VERSION_KEY.format(user_id): version
+         for user_id in user_ids},
+        None,
+    )
+
+
+def load_catalogue_version():
+    return CatalogueVersion.objects.get_or_create(
+        pk=1, defaults={'version': time.time_ns()})[0].version
+
+
+def get_catalogue_version():
+    """
+    Текущая версия справочников: тегов и ингредиентов. Берётся
+    из базы и кэшируется на CATALOGUE_VERSION_TIMEOUT секунд, поэтому
+    изменение из другого процесса видно не позже чем через это время
+    и без общего кэша.
+    """
+    return cache.get_or_set(CATALOGUE_VERSION_KEY, load_catalogue_version,
+                            settings.CATALOGUE_VERSION_TIMEOUT)
+
+
+def bump_catalogue_version():
+    """Меняет версию справочников после изменения тегов или ингредиентов."""
+    version = time.time_ns()
+    CatalogueVersion.objects.update_or_create(
+        pk=1, defaults={'version': version})
+    cache.set(CATALOGUE_VERSION_KEY, version,
+              settings.CATALOGUE_VERSION_TIMEOUT)
+
+
+def get_catalogue_etag(request, *args, **kwargs):
+    """ETag ответов справочников."""
+    return str(get_catalogue_version())
+
+
+def get_catalogue_last_modified(request, *args, **kwargs):
+    """Время последнего изменения справочников."""
+    return datetime.fromtimestamp(
+        get_catalogue_version() // 10 ** 9, tz=timezone.utc)
+
+
+def get_catalogue_key(path):
+    """Ключ кэша ответа справочника для текущей версии."""
+    return CATALOGUE_KEY.format(
+        get_catalogue_version(),
+        hashlib.md5(path.encode()).hexdigest(),
+    )
+
+
+def get_tag_ids():
+    """Словарь slug -> id тегов для текущей версии справочников."""
+    return cache.get_or_set(
+        TAG_IDS_KEY.format(get_catalogue_version()),
+        lambda: dict(Tag.objects.values_list('slug', 'id')),
+        settings.CATALOGUE_CACHE_TIMEOUT,
+    )
+
+
+def bump_recipe_version(*recipe_ids):
+    """Делает устаревшими закэшированные фрагменты рецептов."""
+    version = time.time_ns()
+    cache.set_many(
+        {RECIPE_VERSION_KEY.format(recipe_id): version
+         for recipe_id in recipe_ids},
+        None,
+    )
+
+
+def bump_author_version(*user_ids):
+    """Делает устаревшими фрагменты всех рецептов автора."""
+    version = time.time_ns()
+    cache.set_many(
+        {AUTHOR_VERSION_KEY.format(user_id): version
+         for user_id in user_ids},
+        None,
+    )
+
+
+def get_versions(keys):
+    """Версии по ключам; отсутствующие версии создаются."""
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def get_image_digest(recipe):
+    names = f'{recipe.image_thumb.name}|{recipe.image_medium.name}'
+    return hashlib.md5(names.encode()).hexdigest()[:8]
+
+
+def get_recipe_fragments(recipes, base_url, build):
+    """
+    Общие для всех пользователей представления рецептов. Ключ
+    фрагмента включает версии рецепта, автора и справочников, поэтому
+    любое их изменение делает фрагмент недоступным, и имена копий
+    изображения, из которых он построен: фрагмент из строки, прочитанной
+    до сохранения копий фоновым потоком, не попадёт под новый ключ.
+    Недостающие фрагменты строит build(recipes) -> {id: фрагмент}.
+    Возвращает фрагменты в порядке recipes и число попаданий в кэш.
+    """
+    recipe_keys = {recipe.id: RECIPE_VERSION_KEY.format(recipe.id)
+                   for recipe in recipes}
+    author_keys = {recipe.author_id: AUTHOR_VERSION_KEY.format(
+        recipe.author_id) for recipe in recipes}
+    versions = get_versions(
+        [*recipe_keys.values(), *author_keys.values()])
+    prefix = hashlib.md5(base_url.encode()).hexdigest()
+    catalogue_version = get_catalogue_version()
+    keys = {
+        recipe.id: RECIPE_FRAGMENT_KEY.format(
+            prefix,
+            recipe.id,
+            versions[recipe_keys[recipe.id]],
+            versions[author_keys[recipe.author_id]],
+            catalogue_version,
+            get_image_digest(recipe),
+        )
+        for recipe in recipes
+    }
+    fragments = cache.get_many(keys.values())
+    misses = [recipe for recipe in recipes if keys[recipe.id] not in fragments]
+    if misses:
+        built = {keys[recipe_id]: fragment
+                 for recipe_id, fragment in build(misses).items()}
+        cache.set_many(built, settings.RECIPE_FRAGMENT_CACHE_TIMEOUT)
+        fragments.update(built)
+    return ([fragments[keys[recipe.id]] for recipe in recipes],
+            len(recipes) - len(misses))
+
+
+def load_user_relations(user_id):
+    return UserRelations(*(
+        frozenset(queryset.values_list(field, flat=True))
+        for queryset, field in (
+            (Favorite.objects.filter(user_id=user_id), 'recipe_id'),
+            (ShoppingCart.objects.filter(user_id=user_id), 'recipe_id'),
+            (Subscribe.objects.filter(user_id=user_id), 'author_id'),
+        )
+    ))
+
+
+def get_user_relations(request):
+    """
+    Избранные рецепты, рецепты в корзине и авторы, на которых
+    подписан пользователь запроса. Снимок читается из кэша один раз
+    за запрос и сохраняется в request.user_relations.
+    """
+    relations = getattr(request, 'user_relations', None)
+    if relations is None:
+        user = request.user
+        if user.is_anonymous:
+            relations = NO_RELATIONS
+        else:
+            relations = cache.get_or_set(
+                USER_RELATIONS_KEY.format(user.id),
+                lambda: load_user_relations(user.id),
+                settings.USER_RELATIONS_CACHE_TIMEOUT,
+            )
+        request.user_relations = relations
+    return relations
+
+
+def invalidate_user_relations(*user_ids):
+    """Удаляет снимки связей пользователей после их изменения."""
+    cache.delete_many(
+        [USER_RELATIONS_KEY.format(user_id) for user_id in user_ids])
+
+
+def invalidate_auth_user(*user_ids):
+    """Удаляет пользователей из кэша аутентификации."""
+    cache.delete_many([AUTH_USER_KEY.format(user_id) for user_id in user_ids])
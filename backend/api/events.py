@@ -0,0 +1,314 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.db import close_old_connections
+from django.utils.module_loading import import_string
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.exceptions import (AuthenticationFailed,
+                                                 InvalidToken)
+
+from .authentication import CachedJWTAuthentication
+from users.models import Subscribe
+
+logger = logging.getLogger(__name__)
+
+TICKET_SALT = 'api.events.ticket'
+
+
+def get_channel(user_id):
+    """Канал событий пользователя."""
+    return f'{settings.EVENTS_CHANNEL_PREFIX}{user_id}'
+
+
+class LocalBroker:
+    """
+    Брокер событий в памяти процесса. Подходит, когда API и поток
+    событий обслуживает один процесс ASGI, а также для тестов.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        """Передаёт сообщение подписчикам канала из любого потока."""
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self.deliver, queue, message)
+
+    @staticmethod
+    def deliver(queue, message):
+        # Медленный клиент теряет самые старые события,
+        # а не память процесса.
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+    async def subscribe(self, *channels):
+        """Асинхронный генератор сообщений каналов."""
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            for channel in channels:
+                self.subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            with self.lock:
+                for channel in channels:
+                    self.subscribers[channel].discard(subscriber)
+                    if not self.subscribers[channel]:
+                        del self.subscribers[channel]
+
+
+class RedisBroker(LocalBroker):
+    """
+    Брокер для нескольких процессов: события публикуются в Redis,
+    а каждый процесс ASGI держит одну подписку на все каналы
+    и раздаёт сообщения своим клиентам через LocalBroker.
+    """
+
+    def __init__(self):
+        super().__init__()
+        import redis
+        self.redis = redis.Redis.from_url(settings.EVENTS_BROKER_URL)
+        self.listener = None
+
+    def publish(self, channel, message):
+        self.redis.publish(channel, message)
+
+    async def subscribe(self, *channels):
+        if self.listener is None or self.listener.done():
+            self.listener = asyncio.ensure_future(self.listen())
+        async for message in super().subscribe(*channels):
+            yield message
+
+    async def listen(self):
+        from redis import asyncio as aioredis
+        client = aioredis.Redis.from_url(settings.EVENTS_BROKER_URL)
+        pubsub = client.pubsub()
+        await pubsub.psubscribe(f'{settings.EVENTS_CHANNEL_PREFIX}*')
+        try:
+            async for item in pubsub.listen():
+                if item['type'] == 'pmessage':
+                    LocalBroker.publish(
+                        self, item['channel'].decode(),
+                        item['data'].decode())
+        finally:
+            await pubsub.close()
+            await client.close()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Брокер событий из настройки EVENTS_BROKER."""
+    return import_string(settings.EVENTS_BROKER)()
+
+
+def get_author_channel(author_id):
+    """Канал событий автора, на который подписаны потоки подписчиков."""
+    return f'{settings.EVENTS_CHANNEL_PREFIX}author:{author_id}'
+
+
+def publish(channels, event, data):
+    """
+    Отправляет событие в каналы. Сообщение форматируется в SSE один
+    раз; ошибка брокера для одного канала не мешает отправке в остальные.
+    """
+    message = f'event: {event}\ndata: {json.dumps(data)}\n\n'
+    broker = get_broker()
+    for channel in channels:
+        try:
+            broker.publish(channel, message)
+        except Exception:
+            logger.exception('Не удалось отправить событие %s в канал %s',
+                             event, channel)
+
+
+def publish_event(user_ids, event, data):
+    """Отправляет событие пользователям."""
+    publish([get_channel(user_id) for user_id in user_ids], event, data)
+
+
+def publish_author_event(author_id, event, data):
+    """
+    Отправляет событие подписчикам автора одним сообщением в канал
+    автора, сколько бы у него ни было подписчиков.
+    """
+    publish([get_author_channel(author_id)], event, data)
+
+
+def make_ticket(user_id):
+    """
+    Подписанный билет для подключения к потоку событий. EventSource
+    в браузере не умеет передавать заголовки, поэтому билет
+    передаётся в адресе; в отличие от токена он действует
+    EVENTS_TICKET_MAX_AGE секунд и не страшен в логах.
+    """
+    return signing.dumps(user_id, salt=TICKET_SALT)
+
+
+def get_ticket_user_id(ticket):
+    try:
+        return signing.loads(ticket, salt=TICKET_SALT,
+                             max_age=settings.EVENTS_TICKET_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def get_authorization(scope):
+    """Схема и ключ из заголовка Authorization."""
+    headers = dict(scope['headers'])
+    keyword, _, key = headers.get(
+        b'authorization', b'').decode().partition(' ')
+    return keyword, key
+
+
+def get_ticket(scope):
+    """Билет из параметра ticket."""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    return query.get('ticket', [None])[0]
+
+
+def get_jwt_user_id(key):
+    """Пользователь по access-токену JWT, как в API."""
+    authentication = CachedJWTAuthentication()
+    try:
+        return authentication.get_user(
+            authentication.get_validated_token(key)).id
+    except (AuthenticationFailed, InvalidToken):
+        return None
+
+
+def get_user_id(scope):
+    """
+    Пользователь по токену DRF или, с JWT_AUTH, по access-токену
+    из заголовка Authorization либо по билету из параметра ticket.
+    """
+    keyword, key = get_authorization(scope)
+    if keyword == 'Token' and key:
+        return Token.objects.filter(
+            key=key, user__is_active=True,
+        ).values_list('user_id', flat=True).first()
+    if keyword == 'Bearer' and key and settings.JWT_AUTH:
+        return get_jwt_user_id(key)
+    ticket = get_ticket(scope)
+    user_id = ticket and get_ticket_user_id(ticket)
+    if user_id is None:
+        return None
+    return get_user_model().objects.filter(
+        pk=user_id, is_active=True,
+    ).values_list('id', flat=True).first()
+
+
+def get_stream_channels(scope):
+    """
+    Каналы потока: канал пользователя и каналы авторов, на которых
+    он подписан. None, если пользователь не аутентифицирован.
+    Подписки читаются при подключении; после новой подписки события
+    автора приходят с переподключения.
+    """
+    close_old_connections()
+    try:
+        user_id = get_user_id(scope)
+        if user_id is None:
+            return None
+        return [get_channel(user_id)] + [
+            get_author_channel(author_id)
+            for author_id in Subscribe.objects.filter(
+                user_id=user_id).values_list('author_id', flat=True)]
+    finally:
+        close_old_connections()
+
+
+class EventStream:
+    """
+    ASGI-приложение: отдаёт события пользователя по EVENTS_PATH
+    в формате Server-Sent Events, остальные запросы передаёт Django.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http'
+                or scope['path'] != settings.EVENTS_PATH):
+            return await self.application(scope, receive, send)
+        channels = await sync_to_async(get_stream_channels)(scope)
+        if channels is None:
+            return await self.send_unauthorized(send)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await self.stream(channels, receive, send)
+
+    async def send_unauthorized(self, send):
+        body = json.dumps(
+            {'detail': 'Учетные данные не были предоставлены.'},
+            ensure_ascii=False,
+        ).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 401,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def stream(self, channels, receive, send):
+        messages = get_broker().subscribe(*channels)
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+        message = None
+        try:
+            await self.send_chunk(
+                send, f'retry: {settings.EVENTS_RETRY_MS}\n\n')
+            while True:
+                if message is None:
+                    message = asyncio.ensure_future(messages.__anext__())
+                done, _ = await asyncio.wait(
+                    {message, disconnected},
+                    timeout=settings.EVENTS_KEEPALIVE,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected in done:
+                    break
+                if message in done:
+                    await self.send_chunk(send, message.result())
+                    message = None
+                else:
+                    await self.send_chunk(send, ': keepalive\n\n')
+        finally:
+            tasks = [task for task in (message, disconnected) if task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await messages.aclose()
+
+    @staticmethod
+    async def send_chunk(send, text):
+        await send({
+            'type': 'http.response.body',
+            'body': text.encode(),
+            'more_body': True,
+        })
+
+    @staticmethod
+    async def wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
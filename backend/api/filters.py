@@ -1,44 +1,81 @@
-from django.contrib.auth import get_user_model
+from django import forms
+from django.conf import settings
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from .cache import get_tag_ids, get_user_relations
+from recipes.models import Favorite, Recipe, ShoppingCart
+from recipes.search import (filter_by_ingredients, rank_by_pantry,
+                            search_recipes)
 
-User = get_user_model()
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Фильтр по списку целых чисел через запятую."""
+    field_class = forms.IntegerField
 
-class IngredientFilter(FilterSet):
-    """Фильтр для ингредиентов."""
-    name = filters.CharFilter(lookup_expr='startswith')
 
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class RecipeFilter(FilterSet):
-    """Фильтр для рецептов."""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    """
+    Фильтр для рецептов. Условия по связанным таблицам записаны
+    подзапросами, а не JOIN, поэтому рецепты не дублируются
+    и DISTINCT не нужен.
+    """
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags',
     )
-
+    author = filters.NumberFilter(field_name='author_id')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
+    has_ingredients = NumberInFilter(method='filter_has_ingredients')
+    exclude_ingredients = NumberInFilter(method='filter_exclude_ingredients')
+    pantry = NumberInFilter(method='filter_pantry')
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def filter_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tag_ids[slug] for slug in value],
+        )))
+
+    def filter_user_relation(self, queryset, field, model, value):
+        # Обычно избранного и корзины у пользователя немного, и рецепты
+        # выбираются по первичному ключу из снимка связей пользователя.
+        # Длинный список заменяется подзапросом к таблице связей.
+        if not value or self.request.user.is_anonymous:
+            return queryset
+        recipe_ids = getattr(get_user_relations(self.request), field)
+        if len(recipe_ids) <= settings.USER_RELATIONS_MAX_IDS:
+            return queryset.filter(pk__in=recipe_ids)
+        return queryset.filter(Exists(model.objects.filter(
+            user=self.request.user, recipe=OuterRef('pk'))))
+
     def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
-        if value and not user.is_anonymous:
-            return queryset.filter(favorites__user=user)
-        return queryset
+        return self.filter_user_relation(
+            queryset, 'favorites', Favorite, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value and not user.is_anonymous:
-            return queryset.filter(shopping_cart__user=user)
-        return queryset
+        return self.filter_user_relation(
+            queryset, 'shopping_cart', ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_has_ingredients(self, queryset, name, value):
+        return filter_by_ingredients(queryset, include=value)
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        return filter_by_ingredients(queryset, exclude=value)
+
+    def filter_pantry(self, queryset, name, value):
+        return rank_by_pantry(queryset, value)
@@ -0,0 +1,291 @@
+import json
+import math
+import statistics
+import time
+from base64 import b64encode
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from api.plans import capture_queries, find_full_scans
+from api.serializers import JWTCreateSerializer
+from recipes.models import Ingredient, Recipe, ShoppingCart, Tag
+from users.models import Subscribe
+
+# Число ингредиентов в замерах обновления рецепта.
+WRITE_INGREDIENTS = (1, 10, 25, 50)
+# Сколько первых букв названия ингредиента набирается в замерах
+# автодополнения, по запросу на каждую букву.
+KEYSTROKES = 6
+# Корзины троттлинга, которые замеры не исчерпают: стоимость
+# троттлинга остаётся в замерах, а отказов нет.
+UNTHROTTLED = {scope: (10 ** 9, 10 ** 9) for scope in (
+    'user', 'anon', 'user_heavy', 'anon_heavy')}
+
+
+def percentile(values, percent):
+    """Перцентиль по методу ближайшего ранга."""
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1,
+                      round(percent / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_api' прогоняет основные эндпоинты API через
+    тестовый клиент Django на текущей базе данных и сохраняет
+    p50/p95/p99 времени ответа и количество SQL-запросов в JSON.
+    Обновление рецепта замеряется с разным числом ингредиентов
+    в транзакции, которая затем откатывается, а автодополнение
+    ингредиентов - по каждой набранной букве без кэша справочников.
+    С --explain проверяет планы выполнения запросов и сохраняет
+    таблицы, которые читаются полным сканированием. С --baseline
+    сравнивает результат с сохранённым и завершается ошибкой
+    при регрессии.
+    """
+    help = 'Замеряет время ответа и количество запросов эндпоинтов API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--output', type=Path,
+                            help='Файл для сохранения результатов.')
+        parser.add_argument('--baseline', type=Path,
+                            help='Файл с результатами для сравнения.')
+        parser.add_argument(
+            '--tolerance', type=float, default=1.5,
+            help='Допустимый рост p95 относительно базовой линии.')
+        parser.add_argument(
+            '--explain', action='store_true',
+            help='Искать полные сканирования таблиц в планах запросов.')
+        parser.add_argument(
+            '--auth', choices=('token', 'jwt'), default='token',
+            help='Способ аутентификации; jwt требует JWT_AUTH=1.')
+
+    def get_endpoints(self):
+        user_id = (ShoppingCart.objects.values_list('user_id', flat=True)
+                   .filter(user__follower__isnull=False).first())
+        if user_id is None:
+            raise CommandError(
+                'Нет данных для замеров, выполните seed_foodgram.')
+        recipe = Recipe.objects.only('id', 'author_id').first()
+        tag = Tag.objects.values_list('slug', flat=True).first()
+        author_id = (Subscribe.objects.filter(user_id=user_id)
+                     .values_list('author_id', flat=True).first())
+        last_page = max(1, math.ceil(
+            Recipe.objects.count() / settings.PAGE_SIZE))
+        # Курсор на ту же глубину, что и последняя страница: позиция -
+        # дата публикации рецепта перед ней, как её кодирует DRF.
+        deep_pub_date = Recipe.objects.order_by(
+            '-pub_date', '-id').values_list('pub_date', flat=True)[
+                max(0, (last_page - 1) * settings.PAGE_SIZE - 1)]
+        deep_cursor = b64encode(
+            urlencode({'p': str(deep_pub_date)}).encode('ascii'))
+        popular = [str(ingredient_id) for ingredient_id in (
+            Ingredient.objects.annotate(uses=Count('ingredient_list'))
+            .order_by('-uses').values_list('id', flat=True)[:4])]
+        self.user_id = user_id
+        endpoints = {
+            'recipe-list': '/api/recipes/',
+            'recipe-list-limit-50': '/api/recipes/?limit=50',
+            'recipe-list-cursor': '/api/recipes/?pagination=cursor',
+            'recipe-list-page-deep': f'/api/recipes/?page={last_page}',
+            'recipe-list-cursor-deep': '/api/recipes/?' + urlencode({
+                'pagination': 'cursor', 'cursor': deep_cursor.decode()}),
+            'recipe-list-tags': f'/api/recipes/?tags={tag}',
+            'recipe-list-author': f'/api/recipes/?author={author_id}',
+            'recipe-list-favorited': '/api/recipes/?is_favorited=1',
+            'recipe-list-in-cart': '/api/recipes/?is_in_shopping_cart=1',
+            'recipe-list-search': '/api/recipes/?search=рецепт',
+            'recipe-list-has-ingredients':
+                f'/api/recipes/?has_ingredients={",".join(popular[:2])}',
+            'recipe-list-exclude-ingredients':
+                f'/api/recipes/?exclude_ingredients={",".join(popular[2:])}',
+            'recipe-list-pantry': f'/api/recipes/?pantry={",".join(popular)}',
+            'recipe-detail': f'/api/recipes/{recipe.id}/',
+            'recipe-feed': '/api/recipes/feed/',
+            'recipe-similar': f'/api/recipes/{recipe.id}/similar/',
+            'recipe-trending': '/api/recipes/trending/',
+            'recipe-trending-tag':
+                f'/api/recipes/trending/?tags={tag}',
+            'download-shopping-cart':
+                '/api/recipes/download_shopping_cart/',
+            'users-subscriptions':
+                '/api/users/subscriptions/?recipes_limit=3',
+            'ingredient-search': '/api/ingredients/?name=мол',
+            'tag-list': '/api/tags/',
+        }
+        name = Ingredient.objects.get(id=popular[0]).name
+        for length in range(1, min(KEYSTROKES, len(name)) + 1):
+            endpoints[f'ingredient-keystroke-{length}'] = (
+                f'/api/ingredients/?name={name[:length]}')
+        return endpoints
+
+    def get(self, client, url, body=None):
+        """
+        Запрос к эндпоинту, с body - PATCH; замер с ошибкой в ответе
+        не учитывается.
+        """
+        if body is None:
+            response = client.get(url)
+        else:
+            response = client.patch(url, body,
+                                    content_type='application/json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(
+                f'{url} ответил {response.status_code}, замер невозможен.')
+        return response
+
+    def measure(self, client, url, iterations, warmup, bodies=(None,),
+                cold=False):
+        """
+        Замер запросов к url, тела запросов чередуются по кругу.
+        С cold к url добавляется номер запроса, чтобы ответ
+        не брался из кэша справочников.
+        """
+        def get_url(number):
+            return f'{url}&cold={number}' if cold else url
+
+        for number in range(warmup):
+            self.get(client, get_url(number), bodies[number % len(bodies)])
+        timings = []
+        queries = []
+        for number in range(iterations):
+            body = bodies[number % len(bodies)]
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.get(client, get_url(warmup + number), body)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context))
+        return {
+            'status': 200,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'p99_ms': round(percentile(timings, 99), 2),
+            'queries': max(queries),
+        }
+
+    def measure_writes(self, client, iterations, warmup):
+        """
+        Обновление рецепта с WRITE_INGREDIENTS ингредиентами: наборы
+        ингредиентов чередуются, поэтому каждый запрос заменяет все
+        строки. Рецепт и изменения откатываются после замеров.
+        """
+        ingredient_ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True)[:2 * max(WRITE_INGREDIENTS)])
+        tag_ids = list(Tag.objects.values_list('id', flat=True)[:1])
+        results = {}
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                author_id=self.user_id,
+                name='Рецепт для замеров',
+                text='Описание рецепта для замеров.',
+                image=Recipe.objects.values_list('image', flat=True)[0],
+                cooking_time=10,
+            )
+            for count in WRITE_INGREDIENTS:
+                bodies = [json.dumps({
+                    'tags': tag_ids,
+                    'ingredients': [{'id': ingredient_id, 'amount': 1}
+                                    for ingredient_id in ingredient_ids[
+                                        start:start + count]],
+                }) for start in (0, count)]
+                results[f'recipe-update-ingredients-{count}'] = self.measure(
+                    client, f'/api/recipes/{recipe.id}/', iterations,
+                    warmup, bodies)
+            transaction.set_rollback(True)
+        return results
+
+    def find_full_scans(self, client, url):
+        """Таблицы, которые запросы эндпоинта читают целиком."""
+        with capture_queries() as executed:
+            client.get(url)
+        return find_full_scans(executed)
+
+    def get_authorization(self, auth):
+        if auth == 'token':
+            token = Token.objects.get_or_create(user_id=self.user_id)[0]
+            return f'Token {token.key}'
+        if not settings.JWT_AUTH:
+            raise CommandError('JWT выключен, задайте JWT_AUTH=1.')
+        user = get_user_model().objects.get(pk=self.user_id)
+        return f'Bearer {JWTCreateSerializer.get_token(user).access_token}'
+
+    @override_settings(THROTTLE_RATES=UNTHROTTLED)
+    def handle(self, *args, **options):
+        endpoints = self.get_endpoints()
+        client = Client(
+            HTTP_HOST='localhost',
+            HTTP_AUTHORIZATION=self.get_authorization(options['auth']),
+        )
+        results = {}
+        for name, url in endpoints.items():
+            results[name] = self.measure(
+                client, url, options['iterations'], options['warmup'],
+                cold=name.startswith('ingredient-keystroke'))
+            if options['explain']:
+                results[name]['full_scans'] = self.find_full_scans(
+                    client, url)
+        results.update(self.measure_writes(
+            client, options['iterations'], options['warmup']))
+        for name in results:
+            self.stdout.write(
+                f'{name:<32} {results[name]["status"]} '
+                f'p50 {results[name]["p50_ms"]:>8} мс  '
+                f'p95 {results[name]["p95_ms"]:>8} мс  '
+                f'p99 {results[name]["p99_ms"]:>8} мс  '
+                f'запросов {results[name]["queries"]}'
+            )
+            for table in results[name].get('full_scans', ()):
+                self.stdout.write(f'    полное сканирование {table}')
+        if options['output']:
+            options['output'].write_text(
+                json.dumps(results, ensure_ascii=False, indent=2))
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def compare(self, results, path, tolerance):
+        try:
+            baseline = json.loads(path.read_text())
+        except (OSError, ValueError) as error:
+            raise CommandError(
+                f'Не удалось прочитать базовую линию {path}: {error}')
+        regressions = []
+        for name, expected in baseline.items():
+            actual = results.get(name)
+            if actual is None:
+                continue
+            if expected.get('status', 200) != 200:
+                regressions.append(
+                    f'{name}: базовая линия снята с ответом '
+                    f'{expected["status"]}, её нужно снять заново')
+                continue
+            if actual['queries'] > expected['queries']:
+                regressions.append(
+                    f'{name}: запросов {actual["queries"]} '
+                    f'вместо {expected["queries"]}')
+            new_scans = set(actual.get('full_scans', ())) - set(
+                expected.get('full_scans', actual.get('full_scans', ())))
+            if new_scans:
+                regressions.append(
+                    f'{name}: полное сканирование {", ".join(new_scans)}')
+            if actual['p95_ms'] > expected['p95_ms'] * tolerance:
+                regressions.append(
+                    f'{name}: p95 {actual["p95_ms"]} мс '
+                    f'при базовом {expected["p95_ms"]} мс')
+        if regressions:
+            raise CommandError(
+                'Регрессия производительности:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(
+            'Регрессий относительно базовой линии нет.'))
@@ -0,0 +1,74 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .benchmark_api import percentile
+from api.authentication import CachedJWTAuthentication
+from api.cache import invalidate_auth_user
+from api.serializers import JWTCreateSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Команда 'benchmark_auth' замеряет стоимость аутентификации одного
+    запроса: токеном DRF, JWT с загрузкой пользователя из базы и JWT
+    с пользователем из кэша.
+    """
+    help = 'Замеряет накладные расходы аутентификации на запрос.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+
+    def measure(self, authentication, authorization, iterations):
+        factory = APIRequestFactory()
+        timings = []
+        queries = 0
+        for _ in range(iterations):
+            request = Request(factory.get(
+                '/api/users/me/', HTTP_AUTHORIZATION=authorization))
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                if authentication.authenticate(request) is None:
+                    raise CommandError('Аутентификация не прошла.')
+                timings.append((time.perf_counter() - started) * 1000)
+            queries += len(context)
+        return {
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'queries': round(queries / iterations, 2),
+        }
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_active=True).order_by('pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей для замеров.')
+        token = Token.objects.get_or_create(user=user)[0].key
+        access = JWTCreateSerializer.get_token(user).access_token
+        invalidate_auth_user(user.id)
+        modes = (
+            ('token', TokenAuthentication(), f'Token {token}', 0),
+            ('jwt', CachedJWTAuthentication(), f'Bearer {access}', 0),
+            ('jwt-cached', CachedJWTAuthentication(), f'Bearer {access}',
+             300),
+        )
+        for name, authentication, authorization, timeout in modes:
+            with override_settings(JWT_USER_CACHE_TIMEOUT=timeout):
+                result = self.measure(
+                    authentication, authorization, options['iterations'])
+            self.stdout.write(
+                f'{name:<12} p50 {result["p50_ms"]:>7} мс  '
+                f'p95 {result["p95_ms"]:>7} мс  '
+                f'запросов {result["queries"]}'
+            )
+        invalidate_auth_user(user.id)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.counters import get_counters, recount
+from users.models import Subscribe
+
+COUNTED_MODELS = (Favorite, ShoppingCart, Recipe, Subscribe)
+
+
+class Command(BaseCommand):
+    """
+    Команда 'reconcile_counters' сверяет денормализованные счётчики
+    рецептов и пользователей с фактическим числом строк и исправляет
+    расхождения пачками, не блокируя таблицы целиком.
+    """
+    help = ('Исправляет расхождения в счётчиках избранного, корзин, '
+            'рецептов и подписчиков.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model in COUNTED_MODELS:
+            for field, counter in get_counters(model):
+                fixed = 0
+                pks = field.related_model.objects.order_by(
+                    'pk').values_list('pk', flat=True)
+                last_pk = None
+                while True:
+                    batch = pks if last_pk is None else pks.filter(
+                        pk__gt=last_pk)
+                    batch = list(batch[:batch_size])
+                    if not batch:
+                        break
+                    last_pk = batch[-1]
+                    with transaction.atomic():
+                        fixed += recount(model, {field.name: batch},
+                                         drifted_only=True)
+                self.stdout.write(
+                    f'{field.related_model._meta.label}.{counter}: '
+                    f'исправлено {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счётчики сверены.'))
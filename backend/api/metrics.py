@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+METRICS = (
+    ('foodgram_db_queries_total', 'db_queries',
+     'Количество SQL-запросов.'),
+    ('foodgram_db_query_seconds_total', 'db_seconds',
+     'Время выполнения SQL-запросов.'),
+    ('foodgram_serializer_seconds_total', 'serializer_seconds',
+     'Время работы представления без учёта SQL-запросов '
+     '(сериализация и логика).'),
+    ('foodgram_response_bytes_total', 'response_bytes',
+     'Размер тел ответов.'),
+    ('foodgram_recipe_fragment_hits_total', 'fragment_hits',
+     'Представления рецептов, взятые из кэша фрагментов.'),
+    ('foodgram_recipe_fragment_misses_total', 'fragment_misses',
+     'Представления рецептов, построенные заново.'),
+    ('foodgram_throttle_cost_total', 'throttle_cost',
+     'Токены, списанные из корзин троттлинга.'),
+    ('foodgram_throttled_total', 'throttled',
+     'Запросы, отклонённые троттлингом.'),
+    ('foodgram_throttle_level_total', 'throttle_level',
+     'Сумма остатков корзин после запросов; средний остаток - '
+     'отношение к foodgram_request_duration_seconds_count.'),
+)
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов текущего процесса по именам маршрутов.
+
+    При заданном METRICS_DIR каждый процесс периодически сохраняет
+    свои метрики в отдельный файл, а экспорт объединяет файлы всех
+    воркеров gunicorn.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._flushed = time.monotonic()
+
+    def _empty(self):
+        return {
+            'count': 0,
+            'seconds': 0.0,
+            'buckets': [0] * len(settings.METRICS_BUCKETS),
+            'db_queries': 0,
+            'db_seconds': 0.0,
+            'serializer_seconds': 0.0,
+            'response_bytes': 0,
+            'fragment_hits': 0,
+            'fragment_misses': 0,
+            'throttle_cost': 0,
+            'throttled': 0,
+            'throttle_level': 0.0,
+        }
+
+    def record(self, route, seconds, **values):
+        with self._lock:
+            stats = self._routes.setdefault(route, self._empty())
+            stats['count'] += 1
+            stats['seconds'] += seconds
+            for number, bound in enumerate(settings.METRICS_BUCKETS):
+                if seconds <= bound:
+                    stats['buckets'][number] += 1
+            for name, value in values.items():
+                stats[name] += value
+        if (settings.METRICS_DIR and time.monotonic() - self._flushed
+                > settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Сохраняет метрики процесса в файл для соседних воркеров."""
+        self._flushed = time.monotonic()
+        directory = Path(settings.METRICS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            content = json.dumps(self._routes)
+        path = directory / f'{os.getpid()}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(content)
+        temporary.replace(path)
+
+    def collect(self):
+        """Метрики всех процессов, сложенные по маршрутам."""
+        if not settings.METRICS_DIR:
+            with self._lock:
+                return json.loads(json.dumps(self._routes))
+        self.flush()
+        routes = {}
+        for path in Path(settings.METRICS_DIR).glob('*.json'):
+            try:
+                snapshot = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for route, stats in snapshot.items():
+                total = routes.setdefault(route, self._empty())
+                for name, value in stats.items():
+                    if name == 'buckets':
+                        total[name] = [a + b for a, b in zip(
+                            total[name], value)]
+                    else:
+                        total[name] += value
+        return routes
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus."""
+        routes = sorted(self.collect().items())
+        lines = [
+            '# HELP foodgram_request_duration_seconds '
+            'Время обработки запроса.',
+            '# TYPE foodgram_request_duration_seconds histogram',
+        ]
+        for route, stats in routes:
+            for bound, count in zip(settings.METRICS_BUCKETS,
+                                    stats['buckets']):
+                lines.append(
+                    f'foodgram_request_duration_seconds_bucket'
+                    f'{{route="{route}",le="{bound}"}} {count}')
+            lines.extend((
+                f'foodgram_request_duration_seconds_bucket'
+                f'{{route="{route}",le="+Inf"}} {stats["count"]}',
+                f'foodgram_request_duration_seconds_sum'
+                f'{{route="{route}"}} {stats["seconds"]}',
+                f'foodgram_request_duration_seconds_count'
+                f'{{route="{route}"}} {stats["count"]}',
+            ))
+        for metric, name, description in METRICS:
+            lines.append(f'# HELP {metric} {description}')
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(
+                f'{metric}{{route="{route}"}} {stats[name]}'
+                for route, stats in routes
+            )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,94 @@
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import registry
+
+
+class MetricsMiddleware:
+    """
+    Собирает по каждому маршруту время ответа, количество и время
+    SQL-запросов, время работы представления и размер ответа.
+    Добавляет заголовок Server-Timing и заголовки RateLimit-* с
+    ёмкостью и остатком корзины троттлинга.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.metrics = {
+            'db_queries': 0,
+            'db_seconds': 0.0,
+            'view_started': None,
+            'view_db_seconds': 0.0,
+            'serializer_seconds': 0.0,
+            'fragment_hits': 0,
+            'fragment_misses': 0,
+            'throttle_cost': 0,
+            'throttled': 0,
+            'throttle_limit': None,
+            'throttle_level': None,
+        }
+        started = time.perf_counter()
+        with connection.execute_wrapper(
+                lambda *args: self.record_query(request, *args)):
+            response = self.get_response(request)
+        seconds = time.perf_counter() - started
+        self.finish_view(request)
+        metrics = request.metrics
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.record(
+            route,
+            seconds,
+            db_queries=metrics['db_queries'],
+            db_seconds=metrics['db_seconds'],
+            serializer_seconds=metrics['serializer_seconds'],
+            response_bytes=size,
+            fragment_hits=metrics['fragment_hits'],
+            fragment_misses=metrics['fragment_misses'],
+            throttle_cost=metrics['throttle_cost'],
+            throttled=metrics['throttled'],
+            throttle_level=metrics['throttle_level'] or 0.0,
+        )
+        if metrics['throttle_limit'] is not None:
+            response['RateLimit-Limit'] = metrics['throttle_limit']
+            response['RateLimit-Remaining'] = int(metrics['throttle_level'])
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'total;dur={seconds * 1000:.1f}, '
+                f'db;dur={metrics["db_seconds"] * 1000:.1f};'
+                f'desc="{metrics["db_queries"]} queries", '
+                f'serializer;dur={metrics["serializer_seconds"] * 1000:.1f}'
+            )
+        return response
+
+    def record_query(self, request, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            request.metrics['db_queries'] += 1
+            request.metrics['db_seconds'] += time.perf_counter() - started
+
+    def finish_view(self, request):
+        metrics = request.metrics
+        if metrics['view_started'] is None:
+            return
+        metrics['serializer_seconds'] = max(
+            0.0,
+            time.perf_counter() - metrics['view_started']
+            - (metrics['db_seconds'] - metrics['view_db_seconds']),
+        )
+        metrics['view_started'] = None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics['view_started'] = time.perf_counter()
+        request.metrics['view_db_seconds'] = request.metrics['db_seconds']
+
+    def process_template_response(self, request, response):
+        self.finish_view(request)
+        return response
@@ -1,7 +1,89 @@
+from datetime import datetime
+
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = settings.PAGE_SIZE
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Пагинация по курсору (pub_date, id) без COUNT и OFFSET."""
+    page_size_query_param = 'limit'
+    page_size = settings.PAGE_SIZE
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(CursorPagination):
+    """Пагинация подписок по курсору."""
+    page_size_query_param = 'limit'
+    page_size = settings.PAGE_SIZE
+    ordering = ('username',)
+
+
+class FeedPagination(CursorPagination):
+    """
+    Пагинация ленты по ключу (pub_date, id): курсор хранит ключ
+    последнего рецепта страницы, следующая страница начинается
+    строго после него.
+    """
+    page_size_query_param = 'limit'
+    page_size = settings.PAGE_SIZE
+
+    def paginate_keys(self, get_keys, request):
+        """
+        Страница ключей (pub_date, id) от get_keys(position, limit),
+        где position — ключ из курсора или None.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        position = None
+        if cursor is not None:
+            try:
+                pub_date, recipe_id = cursor.position.split('|')
+                position = (datetime.fromisoformat(pub_date), int(recipe_id))
+            except (AttributeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        keys = get_keys(position, self.page_size + 1)
+        self.has_next = len(keys) > self.page_size
+        self.keys = keys[:self.page_size]
+        return self.keys
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        pub_date, recipe_id = self.keys[-1]
+        return self.encode_cursor(Cursor(
+            offset=0,
+            reverse=False,
+            position=f'{pub_date.isoformat()}|{recipe_id}',
+        ))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class CursorPaginationMixin:
+    """
+    Включает пагинацию по курсору параметром ?pagination=cursor,
+    по умолчанию остаётся постраничная пагинация.
+    """
+    cursor_pagination_class = None
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if (self.cursor_pagination_class is not None
+                    and self.request.query_params.get(
+                        settings.PAGINATION_QUERY_PARAM) == 'cursor'):
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
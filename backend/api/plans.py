@@ -0,0 +1,47 @@
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+
+FULL_SCAN_RE = {
+    'sqlite': re.compile(r'^SCAN (\w+)$'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+EXPLAIN_SQL = {
+    'sqlite': 'EXPLAIN QUERY PLAN {}',
+    'postgresql': 'EXPLAIN {}',
+}
+
+
+@contextmanager
+def capture_queries():
+    """Список [(sql, params)] выполненных в блоке запросов."""
+    executed = []
+
+    def capture(execute, sql, params, many, context):
+        executed.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(capture):
+        yield executed
+
+
+def find_full_scans(queries):
+    """
+    Таблицы, которые запросы [(sql, params)] читают целиком. Обход
+    подзапроса из FROM (SCAN ranked в SQLite) сканированием таблицы
+    не считается.
+    """
+    pattern = FULL_SCAN_RE[connection.vendor]
+    existing = set(connection.introspection.table_names())
+    tables = set()
+    with connection.cursor() as cursor:
+        for sql, params in queries:
+            if not sql.startswith('SELECT'):
+                continue
+            cursor.execute(EXPLAIN_SQL[connection.vendor].format(sql), params)
+            for row in cursor.fetchall():
+                match = pattern.search(row[-1])
+                if match and match.group(1) in existing:
+                    tables.add(match.group(1))
+    return sorted(tables)
@@ -0,0 +1,82 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+
+from rest_framework.renderers import BaseRenderer
+
+
+class Echo:
+    """Псевдобуфер, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer, ABC):
+    """
+    Базовый рендерер списка покупок с потоковой выдачей.
+    Подклассы задают media_type, format и stream().
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if 'ingredients' not in data:
+            return json.dumps(data, ensure_ascii=False).encode(self.charset)
+        return ''.join(self.stream(data)).encode(self.charset)
+
+    @abstractmethod
+    def stream(self, data):
+        """Части файла списка покупок в виде строк."""
+
+
+class ShoppingListTXTRenderer(ShoppingListRenderer):
+    """Список покупок в виде текстового файла."""
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, data):
+        yield (f'Список покупок для: {data["user"]}\n\n'
+               f'Дата: {data["date"]:%Y-%m-%d}\n\n')
+        for number, ingredient in enumerate(data['ingredients']):
+            yield (f'{chr(10) if number else ""}'
+                   f'- {ingredient["ingredient__name"]} '
+                   f'({ingredient["ingredient__measurement_unit"]})'
+                   f' - {ingredient["amount"]}')
+        yield f'\n\nFoodgram ({data["date"]:%Y})'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, data):
+        writer = csv.writer(Echo())
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество'))
+        for ingredient in data['ingredients']:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['ingredient__measurement_unit'],
+                ingredient['amount'],
+            ))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    """Список покупок в формате JSON."""
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, data):
+        yield (f'{{"user": {json.dumps(data["user"], ensure_ascii=False)}, '
+               f'"date": "{data["date"]:%Y-%m-%d}", "ingredients": [')
+        for number, ingredient in enumerate(data['ingredients']):
+            item = json.dumps({
+                'name': ingredient['ingredient__name'],
+                'measurement_unit': ingredient['ingredient__measurement_unit'],
+                'amount': ingredient['amount'],
+            }, ensure_ascii=False)
+            yield f'{", " if number else ""}{item}'
+        yield ']}'
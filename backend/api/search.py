@@ -0,0 +1,78 @@
+import bisect
+import difflib
+import threading
+
+from django.conf import settings
+
+from .cache import get_catalogue_version
+from recipes.models import Ingredient
+
+
+def normalize(name):
+    """Приводит название к виду для поиска: без регистра, ё -> е."""
+    return ' '.join(name.casefold().replace('ё', 'е').split())
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строится при первом запросе и перестраивается, когда меняется
+    версия справочников в кэше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._names = []
+        self._items = []
+
+    def _ensure_fresh(self):
+        version = get_catalogue_version()
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            rows = sorted(
+                (normalize(item['name']), item['id'], item)
+                for item in Ingredient.objects.values(
+                    'id', 'name', 'measurement_unit')
+            )
+            self._names = [name for name, _, _ in rows]
+            self._items = [item for _, _, item in rows]
+            self._version = version
+
+    def _exact(self, names, name):
+        start = bisect.bisect_left(names, name)
+        end = bisect.bisect_right(names, name)
+        return range(start, end)
+
+    def search(self, query, limit=None):
+        """
+        Ищет ингредиенты: сначала по началу названия, затем по
+        вхождению подстроки, а при отсутствии совпадений - с опечатками.
+        """
+        self._ensure_fresh()
+        names, items = self._names, self._items
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query = normalize(query)
+        found = []
+        position = bisect.bisect_left(names, query)
+        while (position < len(names) and len(found) < limit
+               and names[position].startswith(query)):
+            found.append(position)
+            position += 1
+        if len(found) < limit:
+            found.extend(
+                position for position, name in enumerate(names)
+                if query in name and not name.startswith(query)
+            )
+        if not found and len(query) >= settings.INGREDIENT_FUZZY_MIN_LENGTH:
+            for name in difflib.get_close_matches(
+                    query, dict.fromkeys(names), n=limit, cutoff=0.75):
+                found.extend(self._exact(names, name))
+        return [items[position] for position in found[:limit]]
+
+
+ingredient_index = IngredientIndex()
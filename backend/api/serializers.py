@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core import exceptions
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Manager, Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, validators
@@ -9,7 +11,10 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.fields import IntegerField, SerializerMethodField
 from rest_framework.relations import PrimaryKeyRelatedField
 from rest_framework.serializers import ModelSerializer, ReadOnlyField
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 
+from .authentication import PASSWORD_CLAIM, get_password_fingerprint
+from .cache import get_recipe_fragments, get_user_relations
 from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
 from users.models import Subscribe
 
@@ -50,9 +55,10 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        return (user.is_authenticated
-                and Subscribe.objects.filter(user=user, author=obj).exists())
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        relations = get_user_relations(self.context.get('request'))
+        return obj.id in relations.subscriptions
 
 
 class SetPasswordSerializer(serializers.Serializer):
@@ -91,27 +97,46 @@ class SetPasswordSerializer(serializers.Serializer):
         return validated_data
 
 
-class SubscribeListSerializer(ModelSerializer):
+class JWTCreateSerializer(TokenObtainPairSerializer):
+    """Выдаёт пару JWT с отпечатком пароля пользователя."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token[PASSWORD_CLAIM] = get_password_fingerprint(user)
+        return token
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    """Сериализатор для проверки параметра recipes_limit."""
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
+
+
+def get_recipes_limit(request):
+    """Возвращает проверенное значение recipes_limit или None."""
+    serializer = RecipesLimitSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data.get('recipes_limit')
+
+
+class SubscribeListSerializer(CustomUserSerializer):
     """Сериализатор для списка подписок."""
 
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
-    class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + (
+    class Meta(CustomUserSerializer.Meta):
+        fields = CustomUserSerializer.Meta.fields + (
             'recipes',
             'recipes_count',
         )
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit is not None:
-            recipes_limit = int(recipes_limit)
-        recipes = obj.recipes.all()[:recipes_limit]
+        if hasattr(obj, 'recipe_previews'):
+            recipes = obj.recipe_previews
+        else:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            recipes = obj.recipes.all()[:recipes_limit]
         return RecipeShortSerializer(recipes, many=True).data
 
 
@@ -154,6 +179,20 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
+class ImageVariantField(serializers.ImageField):
+    """Уменьшенная копия изображения рецепта, при её отсутствии - оригинал."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return super().to_representation(
+            getattr(recipe, self.variant) or recipe.image)
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения ингредиентов в рецептах."""
 
@@ -167,12 +206,27 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: общие части всех рецептов берутся из кэша разом."""
+
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, Manager) else data
+        return self.child.represent(list(recipes))
+
+
 class RecipeReadSerializer(ModelSerializer):
-    """Сериализатор для модели рецептов."""
+    """
+    Сериализатор для модели рецептов. Представление без полей,
+    зависящих от пользователя, кэшируется, а is_favorited,
+    is_in_shopping_cart и author.is_subscribed добавляются к нему
+    при каждом запросе.
+    """
     tags = TagSerializer(many=True, read_only=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientInRecipeSerializer(many=True)
     image = Base64ImageField()
+    image_thumb = ImageVariantField('image_thumb')
+    image_medium = ImageVariantField('image_medium')
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
 
@@ -187,26 +241,72 @@ class RecipeReadSerializer(ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumb',
+            'image_medium',
             'text',
             'cooking_time',
         )
+        list_serializer_class = RecipeListSerializer
+
+    def to_representation(self, recipe):
+        return self.represent([recipe])[0]
+
+    def represent(self, recipes):
+        request = self.context.get('request')
+        fragments, hits = get_recipe_fragments(
+            recipes,
+            request.build_absolute_uri('/') if request else '',
+            self.build_fragments,
+        )
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            metrics['fragment_hits'] += hits
+            metrics['fragment_misses'] += len(recipes) - hits
+        return [self.add_user_fields(recipe, fragment)
+                for recipe, fragment in zip(recipes, fragments)]
+
+    def build_fragments(self, recipes):
+        """
+        Полные представления рецептов, которых нет в кэше. Поля
+        пользователя в них перезаписываются в add_user_fields.
+        """
+        prefetch_related_objects(
+            recipes,
+            'tags',
+            Prefetch('ingredients',
+                     queryset=IngredientInRecipe.objects.select_related(
+                         'ingredient')),
+        )
+        fragments = {}
+        for recipe in recipes:
+            fragments[recipe.id] = super().to_representation(recipe)
+        return fragments
+
+    def add_user_fields(self, recipe, fragment):
+        data = dict(fragment)
+        data['author'] = dict(
+            fragment['author'],
+            is_subscribed=self.fields['author'].get_is_subscribed(
+                recipe.author),
+        )
+        data['is_favorited'] = self.get_is_favorited(recipe)
+        data['is_in_shopping_cart'] = self.get_is_in_shopping_cart(recipe)
+        return data
 
     def get_is_favorited(self, recipe):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorites.filter(recipe=recipe).exists()
+        relations = get_user_relations(self.context.get('request'))
+        return recipe.id in relations.favorites
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.shopping_cart.filter(recipe=recipe).exists()
+        relations = get_user_relations(self.context.get('request'))
+        return recipe.id in relations.shopping_cart
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     '''Сериализатор для отображения краткой информации рецептов.'''
     image = Base64ImageField()
+    image_thumb = ImageVariantField('image_thumb')
+    image_medium = ImageVariantField('image_medium')
 
     class Meta:
         model = Recipe
@@ -214,10 +314,29 @@ class RecipeShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumb',
+            'image_medium',
             'cooking_time'
         )
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список рецептов для пакетного добавления и удаления."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPE_BATCH_MAX_SIZE,
+    )
+
+    def validate_recipes(self, value):
+        recipes = Recipe.objects.in_bulk(set(value))
+        missing = sorted(set(value) - recipes.keys())
+        if missing:
+            raise ValidationError(
+                f'Рецепты не существуют: {", ".join(map(str, missing))}')
+        return list(recipes.values())
+
+
 class IngredientInRecipeWriteSerializer(ModelSerializer):
     """Сериализатор для создания ингредиентов в рецепте."""
     id = IntegerField(write_only=True)
@@ -265,18 +384,20 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             raise ValidationError({
                 'ingredients': 'Нужен хотя бы один ингредиент!'
             })
-        ingredients_list = []
-        for item in value:
-            ingredient = get_object_or_404(Ingredient, id=item['id'])
-            if ingredient in ingredients_list:
-                raise ValidationError({
-                    'ingredients': 'Ингридиенты не должны повторяться!'
-                })
-            if int(item['amount']) <= 0:
-                raise ValidationError({
-                    'amount': 'Количество ингредиента должно быть больше 0!'
-                })
-            ingredients_list.append(ingredient)
+        ingredient_ids = {item['id'] for item in value}
+        if len(ingredient_ids) != len(value):
+            raise ValidationError({
+                'ingredients': 'Ингридиенты не должны повторяться!'
+            })
+        if any(int(item['amount']) <= 0 for item in value):
+            raise ValidationError({
+                'amount': 'Количество ингредиента должно быть больше 0!'
+            })
+        existing = Ingredient.objects.in_bulk(ingredient_ids)
+        if len(existing) != len(ingredient_ids):
+            raise ValidationError({
+                'ingredients': 'Ингредиент не существует!'
+            })
         return value
 
     def validate_tags(self, value):
@@ -292,15 +413,14 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return value
 
     def create_ingredients_amounts(self, ingredients, recipe):
-        for ingredient in ingredients:
-            ing, _ = IngredientInRecipe.objects.get_or_create(
-                ingredient=get_object_or_404(
-                    Ingredient.objects.filter(id=ingredient['id'])
-                ),
-                amount=ingredient['amount'],
-            )
-            recipe.ingredients.add(ing.id)
+        IngredientInRecipe.objects.bulk_create(
+            [IngredientInRecipe(recipe=recipe,
+                                ingredient_id=ingredient['id'],
+                                amount=ingredient['amount'])
+             for ingredient in ingredients]
+        )
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -310,18 +430,23 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                                         ingredients=ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance.tags.clear()
         instance.tags.set(tags)
-        instance.ingredients.clear()
+        instance.ingredients.all().delete()
         self.create_ingredients_amounts(recipe=instance,
                                         ingredients=ingredients)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
-        request = self.context.get('request')
-        context = {'request': request}
-        return RecipeReadSerializer(instance,
-                                    context=context).data
+        # Копии изображения могли быть созданы после сохранения рецепта,
+        # поэтому их имена перечитываются из базы. Ответ строится мимо
+        # кэша фрагментов: записывает фрагменты только чтение рецептов.
+        instance.refresh_from_db(fields=('image_thumb', 'image_medium'))
+        serializer = RecipeReadSerializer(
+            instance, context={'request': self.context.get('request')})
+        fragment = serializer.build_fragments([instance])[instance.id]
+        return serializer.add_user_fields(instance, fragment)
@@ -0,0 +1,220 @@
+from django.contrib.auth import get_user_model, user_logged_out
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from .cache import (bump_author_version, bump_catalogue_version,
+                    bump_recipe_version, bump_shopping_cart_version,
+                    invalidate_auth_user, invalidate_user_relations)
+from .events import publish_author_event, publish_event
+from recipes.feed import fan_out, follow, schedule_feed, unfollow
+from recipes.images import (has_current_variants, schedule_variants,
+                            variants_created)
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, SimilarRecipe, Tag)
+from recipes.search import update_ingredient_sets, update_search_index
+from recipes.similar import refill_similar, schedule_similar, update_similar
+from recipes.trending import remove_trending
+from users.counters import change_counters
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+def recipe_relations_changed(model, user_id, recipe_ids, action):
+    """
+    Сбрасывает кэш списка покупок и связей пользователя и сообщает
+    его устройствам об изменении избранного или корзины. Вызывается
+    и для пакетных операций, которые не отправляют сигналы моделей.
+    """
+    event = 'favorite' if model is Favorite else 'shopping_cart'
+    data = {'action': action, 'recipes': list(recipe_ids)}
+    transaction.on_commit(lambda: invalidate_user_relations(user_id))
+    if model is ShoppingCart:
+        transaction.on_commit(lambda: bump_shopping_cart_version(user_id))
+    transaction.on_commit(lambda: publish_event([user_id], event, data))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def user_recipe_changed(sender, instance, signal, created=False, **kwargs):
+    """Обрабатывает добавление и удаление строки избранного или корзины."""
+    if signal is post_save and not created:
+        return
+    recipe_relations_changed(sender, instance.user_id, [instance.recipe_id],
+                             'added' if created else 'removed')
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def user_recipe_trending_removed(sender, instance, **kwargs):
+    """Вычитает удалённое добавление из популярности рецепта."""
+    transaction.on_commit(lambda: remove_trending(
+        sender, [(instance.recipe_id, instance.created)]))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, created, **kwargs):
+    """Сбрасывает кэш списков покупок, в которых есть рецепт."""
+    if created:
+        return
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe=instance).values_list('user_id', flat=True))
+    if user_ids:
+        transaction.on_commit(
+            lambda: bump_shopping_cart_version(*user_ids))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_changed(sender, instance, **kwargs):
+    """Запускает обработку нового изображения рецепта."""
+    if instance.image and not has_current_variants(instance):
+        schedule_variants(instance)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def catalogue_changed(sender, instance, **kwargs):
+    """Меняет версию справочников тегов и ингредиентов."""
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscribe)
+def counted_row_created(sender, instance, created, raw, **kwargs):
+    """Увеличивает счётчики при создании строки."""
+    if created and not raw:
+        change_counters(instance, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscribe)
+def counted_row_deleted(sender, instance, **kwargs):
+    """Уменьшает счётчики при удалении строки, в том числе каскадном."""
+    change_counters(instance, -1)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_search_changed(sender, instance, **kwargs):
+    """
+    Обновляет поисковый индекс и массив ингредиентов рецепта после
+    фиксации транзакции, когда ингредиенты рецепта уже сохранены.
+    """
+    transaction.on_commit(lambda: update_search_index([instance.id]))
+    transaction.on_commit(lambda: update_ingredient_sets([instance.id]))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_similar_changed(sender, instance, raw, **kwargs):
+    """
+    Пересчитывает похожие рецепты после фиксации транзакции, когда
+    ингредиенты и теги рецепта уже сохранены.
+    """
+    if not raw:
+        schedule_similar(update_similar, instance.id)
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_similar_deleted(sender, instance, **kwargs):
+    """
+    Пересчитывает соседей рецептов, из списков которых удаляемый
+    рецепт выбывает вместе со строками SimilarRecipe.
+    """
+    recipe_ids = list(SimilarRecipe.objects.filter(
+        similar_id=instance.id).values_list('recipe_id', flat=True))
+    if recipe_ids:
+        schedule_similar(refill_similar, recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published_event(sender, instance, created, raw, **kwargs):
+    """Сообщает подписчикам автора о новом рецепте."""
+    if not created or raw:
+        return
+    data = {'recipe': instance.id, 'author': instance.author_id}
+    transaction.on_commit(lambda: publish_author_event(
+        instance.author_id, 'recipe_published', data))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def recipe_fragment_changed(sender, instance, **kwargs):
+    """Сбрасывает кэшированное представление рецепта."""
+    recipe_id = getattr(instance, 'recipe_id', instance.id)
+    transaction.on_commit(lambda: bump_recipe_version(recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set,
+                        **kwargs):
+    """Сбрасывает представления рецептов при смене их тегов."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.id]
+    elif pk_set:
+        recipe_ids = list(pk_set)
+    else:
+        return
+    transaction.on_commit(lambda: bump_recipe_version(*recipe_ids))
+
+
+@receiver(variants_created, sender=Recipe)
+def recipe_variants_created(sender, recipe_id, **kwargs):
+    """Сбрасывает представление рецепта с новыми копиями изображения."""
+    bump_recipe_version(recipe_id)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """Сбрасывает представления рецептов автора при смене профиля."""
+    if created or update_fields == frozenset(('last_login',)):
+        return
+    transaction.on_commit(lambda: bump_author_version(instance.id))
+
+
+@receiver((post_save, post_delete), sender=Subscribe)
+def subscription_changed(sender, instance, **kwargs):
+    """Сбрасывает кэш связей подписчика."""
+    transaction.on_commit(lambda: invalidate_user_relations(instance.user_id))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published_feed(sender, instance, created, raw, **kwargs):
+    """Раскладывает новый рецепт по лентам подписчиков автора."""
+    if created and not raw:
+        schedule_feed(fan_out, instance.id, instance.author_id,
+                      instance.pub_date)
+
+
+@receiver((post_save, post_delete), sender=Subscribe)
+def subscription_feed_changed(sender, instance, signal, created=False,
+                              raw=False, **kwargs):
+    """Добавляет рецепты автора в ленту подписчика или убирает их."""
+    if signal is post_delete:
+        schedule_feed(unfollow, instance.user_id, instance.author_id)
+    elif created and not raw:
+        schedule_feed(follow, instance.user_id, instance.author_id)
+
+
+@receiver((post_save, post_delete), sender=User)
+def auth_user_changed(sender, instance, update_fields=None, **kwargs):
+    """
+    Убирает пользователя из кэша аутентификации по JWT после смены
+    пароля, активности или профиля.
+    """
+    if update_fields == frozenset(('last_login',)):
+        return
+    transaction.on_commit(lambda: invalidate_auth_user(instance.id))
+
+
+@receiver(user_logged_out)
+def auth_user_logged_out(sender, user, **kwargs):
+    """Убирает вышедшего пользователя из кэша аутентификации."""
+    if user is not None:
+        invalidate_auth_user(user.id)
@@ -0,0 +1,1060 @@
+import csv
+import json
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from .authentication import CachedJWTAuthentication, get_auth_user
+from .cache import AUTH_USER_KEY
+from .events import (get_author_channel, get_channel, get_stream_channels,
+                     get_ticket_user_id, get_user_id, publish_event)
+from .plans import capture_queries, find_full_scans
+from .serializers import JWTCreateSerializer
+from .throttling import CostThrottle
+from recipes.feed import get_feed
+from recipes.images import schedule_variants, variants_created
+from recipes.models import (CatalogueVersion, Favorite, FeedEntry, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart,
+                            SimilarRecipe, Tag, TrendingRecipe)
+from recipes.similar import refill_similar, update_similar
+from recipes.trending import refresh_trending
+from users.models import Subscribe, User
+
+
+class RecipeTestCase(TestCase):
+    """Пользователи, авторы, теги и ингредиенты для тестов API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        CatalogueVersion.objects.create(pk=1, version=time.time_ns())
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Читатель', last_name='Тестовый', password='pass')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com',
+                first_name='Автор', last_name=f'Тестовый {number}',
+                password='pass')
+            for number in range(3)
+        ]
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       slug=f'tag{number}',
+                                       color=f'#00000{number}')
+                    for number in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        # Файлов изображений тестовых рецептов нет, их обработка
+        # проверяется в RecipeImageTest.
+        patcher = mock.patch('api.signals.schedule_variants')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_recipes(self, count):
+        for number in range(count):
+            recipe = Recipe.objects.create(
+                author=self.authors[number % len(self.authors)],
+                name=f'Рецепт {number}',
+                text='Описание',
+                image='recipes/images/test.png',
+                cooking_time=10,
+            )
+            recipe.tags.set(self.tags)
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=number + 1)
+                for ingredient in self.ingredients)
+
+
+class QueryCountTest(RecipeTestCase):
+    """
+    Число SQL-запросов эндпоинтов не зависит от числа рецептов
+    на странице: связанные данные загружаются пачками.
+    """
+
+    def assert_same_queries(self, url, expected):
+        """
+        Запросы холодного и тёплого кэша при одном и шести рецептах
+        на странице.
+        """
+        for count in (1, 5):
+            self.create_recipes(count)
+            cache.clear()
+            with self.subTest(recipes=count, cache='cold'):
+                with self.assertNumQueries(expected[0]):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+            with self.subTest(recipes=count, cache='warm'):
+                with self.assertNumQueries(expected[1]):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_recipe_list(self):
+        self.assert_same_queries('/api/recipes/', (5, 2))
+
+    def test_recipe_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_same_queries('/api/recipes/', (8, 2))
+
+    def test_recipe_detail(self):
+        self.create_recipes(1)
+        recipe = Recipe.objects.get()
+        cache.clear()
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/recipes/{recipe.id}/')
+
+    def test_subscriptions(self):
+        for author in self.authors:
+            Subscribe.objects.create(user=self.user, author=author)
+        self.client.force_authenticate(self.user)
+        self.assert_same_queries('/api/users/subscriptions/', (3, 3))
+
+    def test_subscriptions_recipes_limit(self):
+        self.create_recipes(9)
+        for author in self.authors:
+            Subscribe.objects.create(user=self.user, author=author)
+        self.client.force_authenticate(self.user)
+        for limit in ('', '1', '2', '100'):
+            with self.subTest(recipes_limit=limit):
+                with self.assertNumQueries(3):
+                    response = self.client.get(
+                        f'/api/users/subscriptions/?recipes_limit={limit}')
+                for author in response.json()['results']:
+                    self.assertEqual(author['recipes_count'], 3)
+                    self.assertEqual(len(author['recipes']),
+                                     min(int(limit or 3), 3))
+
+
+@skipUnless(connection.vendor == 'sqlite',
+            'На маленьких таблицах PostgreSQL выбирает Seq Scan.')
+class QueryPlanTest(RecipeTestCase):
+    """Запросы эндпоинтов не читают таблицы целиком."""
+
+    def get_full_scans(self, url):
+        with capture_queries() as executed:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return find_full_scans(executed)
+
+    def test_subscriptions_plan(self):
+        self.create_recipes(9)
+        for author in self.authors:
+            Subscribe.objects.create(user=self.user, author=author)
+        self.client.force_authenticate(self.user)
+        for limit in ('', '3'):
+            with self.subTest(recipes_limit=limit):
+                self.assertEqual(self.get_full_scans(
+                    f'/api/users/subscriptions/?recipes_limit={limit}'), [])
+
+    def test_recipe_filters_plan(self):
+        self.create_recipes(9)
+        recipes = Recipe.objects.all()[:3]
+        Favorite.objects.bulk_create(
+            Favorite(user=self.user, recipe=recipe) for recipe in recipes)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe) for recipe in recipes)
+        self.client.force_authenticate(self.user)
+        tag, other = (tag.slug for tag in self.tags)
+        for query in (f'tags={tag}', f'tags={tag}&tags={other}',
+                      f'author={self.authors[0].id}', 'is_favorited=1',
+                      'is_in_shopping_cart=1', f'is_favorited=1&tags={tag}'):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    self.get_full_scans(f'/api/recipes/?{query}'), [])
+
+
+class CounterTest(RecipeTestCase):
+    """Денормализованные счётчики рецептов и пользователей."""
+
+    def setUp(self):
+        super().setUp()
+        self.create_recipes(2)
+        self.recipes = list(Recipe.objects.order_by('id'))
+
+    def assert_counters(self, recipe, favorites, shopping_cart):
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count),
+            (favorites, shopping_cart))
+
+    def assert_user_counters(self, user, recipes, followers):
+        user.refresh_from_db()
+        self.assertEqual((user.recipes_count, user.followers_count),
+                         (recipes, followers))
+
+    def test_create_and_delete(self):
+        recipe, author = self.recipes[0], self.recipes[0].author
+        self.assert_user_counters(author, 1, 0)
+        favorite = Favorite.objects.create(user=self.user, recipe=recipe)
+        cart = ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        subscribe = Subscribe.objects.create(user=self.user, author=author)
+        self.assert_counters(recipe, 1, 1)
+        self.assert_user_counters(author, 1, 1)
+        for row in (favorite, cart, subscribe):
+            row.delete()
+        self.assert_counters(recipe, 0, 0)
+        self.assert_user_counters(author, 1, 0)
+        recipe.delete()
+        self.assert_user_counters(author, 0, 0)
+
+    def test_cascade(self):
+        first, second = self.recipes
+        reader = User.objects.create_user(
+            username='other', email='other@example.com', password='pass')
+        for user in (self.user, reader):
+            Favorite.objects.create(user=user, recipe=second)
+            ShoppingCart.objects.create(user=user, recipe=second)
+            Subscribe.objects.create(user=user, author=second.author)
+        Favorite.objects.create(user=self.user, recipe=first)
+        first.delete()
+        self.assert_user_counters(first.author, 0, 0)
+        self.assert_counters(second, 2, 2)
+        reader.delete()
+        self.assert_counters(second, 1, 1)
+        self.assert_user_counters(second.author, 1, 1)
+
+    def test_bulk_create_ignore_conflicts(self):
+        first, second = self.recipes
+        Favorite.objects.create(user=self.user, recipe=first)
+        Favorite.objects.bulk_create(
+            [Favorite(user=self.user, recipe=recipe)
+             for recipe in self.recipes],
+            ignore_conflicts=True)
+        self.assert_counters(first, 1, 0)
+        self.assert_counters(second, 1, 0)
+
+    def test_reconcile_counters(self):
+        first, second = self.recipes
+        Favorite.objects.create(user=self.user, recipe=first)
+        Subscribe.objects.create(user=self.user, author=first.author)
+        Recipe.objects.update(favorites_count=5, shopping_cart_count=3)
+        User.objects.update(recipes_count=7, followers_count=2)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.assert_counters(first, 1, 0)
+        self.assert_counters(second, 0, 0)
+        self.assert_user_counters(first.author, 1, 1)
+        self.assert_user_counters(self.user, 0, 0)
+
+
+@override_settings(THROTTLE_RATES={
+    'user': (50, 1),
+    'anon': (3, 1),
+    'user_heavy': (100, 1),
+    'anon_heavy': (30, 1),
+})
+class ThrottleTest(RecipeTestCase):
+    """Корзины токенов CostThrottle."""
+
+    def setUp(self):
+        super().setUp()
+        self.timer = mock.Mock(return_value=1000.0)
+        patcher = mock.patch.object(CostThrottle, 'timer', self.timer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_limits(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return (int(response['RateLimit-Limit']),
+                int(response['RateLimit-Remaining']))
+
+    def test_empty_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/tags/').status_code, 200)
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_refill(self):
+        for _ in range(3):
+            self.client.get('/api/tags/')
+        self.assertEqual(self.client.get('/api/tags/').status_code, 429)
+        self.timer.return_value += 2
+        self.assertEqual(self.get_limits('/api/tags/'), (3, 1))
+        self.timer.return_value += 60
+        self.assertEqual(self.get_limits('/api/tags/'), (3, 2))
+
+    def test_limit_multiplier_and_heavy_bucket(self):
+        self.client.force_authenticate(self.user)
+        page_size = settings.PAGE_SIZE
+        self.assertEqual(self.get_limits('/api/recipes/'), (50, 48))
+        self.assertEqual(
+            self.get_limits(f'/api/recipes/?limit={page_size * 2}'),
+            (50, 44))
+        huge = page_size * settings.THROTTLE_MAX_PAGES * 10
+        self.assertEqual(self.get_limits(f'/api/recipes/?limit={huge}'),
+                         (100, 80))
+        self.assertEqual(self.get_limits('/api/recipes/'), (50, 42))
+
+
+class TrendingTest(RecipeTestCase):
+    """Инкрементальный пересчёт популярности и список популярных."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.create_recipes(3)
+        self.recipes = list(Recipe.objects.order_by('id'))
+        self.readers = [self.user, *self.authors]
+
+    def add(self, model, reader, recipe, hours_ago):
+        return model.objects.create(
+            user=reader, recipe=recipe,
+            created=timezone.now() - timedelta(hours=hours_ago))
+
+    def get_scores(self):
+        return dict(TrendingRecipe.objects.values_list('recipe_id', 'score'))
+
+    def assert_scores_equal(self, first, second):
+        self.assertEqual(first.keys(), second.keys())
+        for recipe_id, score in first.items():
+            self.assertAlmostEqual(score, second[recipe_id])
+
+    def test_incremental_matches_full(self):
+        first, second, third = self.recipes
+        self.add(Favorite, self.user, first, 30)
+        self.add(ShoppingCart, self.user, second, 20)
+        earlier = timezone.now() - timedelta(hours=15)
+        with mock.patch('recipes.trending.timezone.now',
+                        return_value=earlier):
+            refresh_trending()
+        self.add(Favorite, self.authors[0], first, 10)
+        self.add(Favorite, self.authors[0], third, 5)
+        self.add(ShoppingCart, self.authors[1], first, 2)
+        refresh_trending()
+        incremental = self.get_scores()
+        self.assertEqual(len(incremental), 3)
+        refresh_trending(full=True)
+        self.assert_scores_equal(incremental, self.get_scores())
+
+    def test_delete_lowers_score(self):
+        recipe = self.recipes[0]
+        for hours_ago, reader in enumerate(self.readers, start=1):
+            self.add(Favorite, reader, recipe, hours_ago)
+        refresh_trending()
+        before = self.get_scores()[recipe.id]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        after = self.get_scores()
+        self.assertLess(after[recipe.id], before)
+        refresh_trending(full=True)
+        self.assert_scores_equal(after, self.get_scores())
+
+    def test_delete_after_watermark_ignored(self):
+        recipe = self.recipes[0]
+        self.add(Favorite, self.authors[0], recipe, 2)
+        refresh_trending()
+        before = self.get_scores()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+            self.client.delete(f'/api/recipes/{recipe.id}/favorite/')
+        self.assertEqual(self.get_scores(), before)
+
+    def test_trending_tags_filter(self):
+        first, second, third = self.recipes
+        second.tags.set(self.tags[1:])
+        for hours_ago, recipe in enumerate((third, second, first), start=1):
+            for reader in self.readers[:hours_ago]:
+                self.add(Favorite, reader, recipe, hours_ago)
+        refresh_trending()
+        response = self.client.get('/api/recipes/trending/')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [first.id, second.id, third.id])
+        response = self.client.get(
+            f'/api/recipes/trending/?tags={self.tags[0].slug}')
+        self.assertEqual(
+            [recipe['id'] for recipe in response.json()['results']],
+            [first.id, third.id])
+
+
+class ShoppingListTest(RecipeTestCase):
+    """Выгрузка списка покупок и её кэш."""
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.create_recipes(3)
+        self.recipes = list(Recipe.objects.order_by('id'))
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=self.user, recipe=recipe)
+            for recipe in self.recipes[:2])
+
+    def download(self, format):
+        response = self.client.get(f'{self.url}?format={format}')
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def get_amounts(self):
+        _, content = self.download('json')
+        return {item['name']: item['amount']
+                for item in json.loads(content)['ingredients']}
+
+    def write(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300)
+
+    def test_formats(self):
+        names = [ingredient.name for ingredient in self.ingredients]
+        for format, content_type in (('txt', 'text/plain'),
+                                     ('csv', 'text/csv'),
+                                     ('json', 'application/json')):
+            with self.subTest(format=format):
+                response, content = self.download(format)
+                self.assertEqual(response['Content-Type'],
+                                 f'{content_type}; charset=utf-8')
+                self.assertEqual(
+                    response['Content-Disposition'],
+                    f'attachment; filename=reader_shopping_list.{format}')
+                if format == 'txt':
+                    self.assertIn(f'- {names[0]} (г) - 3', content)
+                elif format == 'csv':
+                    rows = list(csv.reader(StringIO(content)))
+                    self.assertEqual(rows[1:], [[name, 'г', '3']
+                                                for name in names])
+                else:
+                    data = json.loads(content)
+                    self.assertEqual(data['user'], 'Читатель Тестовый')
+                    self.assertEqual(
+                        data['ingredients'],
+                        [{'name': name, 'measurement_unit': 'г', 'amount': 3}
+                         for name in names])
+
+    def test_second_download_is_cached(self):
+        self.download('txt')
+        with capture_queries() as executed:
+            self.download('csv')
+        self.assertFalse([sql for sql, _ in executed
+                          if 'recipes_ingredientinrecipe' in sql])
+
+    def test_cart_changes_invalidate(self):
+        name = self.ingredients[0].name
+        first, second, third = (recipe.id for recipe in self.recipes)
+        self.assertEqual(self.get_amounts()[name], 3)
+        for method, url, data, amount in (
+            ('post', f'/api/recipes/{third}/shopping_cart/', None, 6),
+            ('delete', f'/api/recipes/{first}/shopping_cart/', None, 5),
+            ('delete', '/api/recipes/shopping_cart/',
+             {'recipes': [second, third]}, None),
+            ('post', '/api/recipes/shopping_cart/',
+             {'recipes': [first, second]}, 3),
+        ):
+            with self.subTest(method=method, url=url):
+                self.write(method, url, data)
+                if amount is None:
+                    self.assertEqual(
+                        self.client.get(self.url).status_code, 400)
+                else:
+                    self.assertEqual(self.get_amounts()[name], amount)
+
+
+class CatalogueTest(RecipeTestCase):
+    """Условные запросы и кэш справочников."""
+
+    def test_validators(self):
+        for url in ('/api/tags/', '/api/ingredients/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response['ETag'])
+                self.assertTrue(response['Last-Modified'])
+
+    def test_not_modified_without_catalogue_queries(self):
+        for url in ('/api/tags/', '/api/ingredients/',
+                    f'/api/tags/{self.tags[0].id}/'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with capture_queries() as executed:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse([
+                    sql for sql, _ in executed
+                    if 'recipes_tag' in sql or 'recipes_ingredient' in sql])
+
+    def test_version_changes(self):
+        url = '/api/ingredients/'
+        etag = self.client.get(url)['ETag']
+        with TemporaryDirectory() as directory:
+            path = Path(directory) / 'ingredients.csv'
+            path.write_text('соль,г\n', encoding='utf-8')
+            call_command('load_ingredients', path, stdout=StringIO())
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('соль', [item['name'] for item in response.json()])
+        etag = response['ETag']
+        ingredient = self.ingredients[0]
+        ingredient.name = 'перец'
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('перец', [item['name'] for item in response.json()])
+
+
+class SearchTestCase(RecipeTestCase):
+    """Рецепты с разными названиями, описаниями и ингредиентами."""
+
+    def setUp(self):
+        super().setUp()
+        self.products = {
+            name: Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Огурец', 'Томат', 'Укроп', 'Свёкла', 'Мука')
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            self.salad = self.add_recipe(
+                'Салат летний', 'Свежие овощи', 'Огурец', 'Томат', 'Укроп')
+            self.soup = self.add_recipe(
+                'Суп', 'Подавать вместо салата', 'Огурец', 'Свёкла')
+            self.cake = self.add_recipe('Пирог', 'Сладкий', 'Мука')
+
+    def add_recipe(self, name, text, *products):
+        recipe = Recipe.objects.create(
+            author=self.authors[0], name=name, text=text,
+            image='recipes/images/test.png', cooking_time=10)
+        recipe.tags.set(self.tags)
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe,
+                               ingredient=self.products[product])
+            for product in products)
+        return recipe
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def get_product_ids(self, *names):
+        return ','.join(str(self.products[name].id) for name in names)
+
+    def edit_soup(self):
+        """Меняет название, описание и ингредиенты рецепта через API."""
+        self.client.force_authenticate(self.authors[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.soup.id}/',
+                {'name': 'Борщ', 'text': 'Густой', 'cooking_time': 60,
+                 'tags': [self.tags[0].id],
+                 'ingredients': [{'id': self.products['Свёкла'].id,
+                                  'amount': 300}]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class SearchTest(SearchTestCase):
+    """Полнотекстовый поиск рецептов."""
+
+    def test_search_ranks_name_first(self):
+        self.assertEqual(self.get_ids('search=салат'),
+                         [self.salad.id, self.soup.id])
+        self.assertCountEqual(self.get_ids('search=огурец'),
+                              [self.salad.id, self.soup.id])
+        self.assertEqual(self.get_ids('search=сладкий пирог'),
+                         [self.cake.id])
+        self.assertEqual(self.get_ids('search=торт'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Префиксы и ё в FTS5.')
+    def test_search_prefix_and_yo(self):
+        self.assertEqual(self.get_ids('search=свекл'), [self.soup.id])
+        self.assertEqual(self.get_ids('search=САЛ'),
+                         [self.salad.id, self.soup.id])
+
+    def test_search_after_edit(self):
+        self.edit_soup()
+        self.assertEqual(self.get_ids('search=борщ'), [self.soup.id])
+        self.assertEqual(self.get_ids('search=суп'), [])
+        self.assertEqual(self.get_ids('search=огурец'), [self.salad.id])
+
+
+class IngredientFilterTest(SearchTestCase):
+    """Фильтры has_ingredients, exclude_ingredients и pantry."""
+
+    def test_has_and_exclude_ingredients(self):
+        self.assertCountEqual(
+            self.get_ids('has_ingredients='
+                         + self.get_product_ids('Огурец')),
+            [self.salad.id, self.soup.id])
+        self.assertEqual(
+            self.get_ids('has_ingredients='
+                         + self.get_product_ids('Огурец', 'Томат')),
+            [self.salad.id])
+        self.assertCountEqual(
+            self.get_ids('exclude_ingredients='
+                         + self.get_product_ids('Томат', 'Мука')),
+            [self.soup.id])
+        self.assertEqual(
+            self.get_ids(
+                f'has_ingredients={self.get_product_ids("Огурец")}'
+                f'&exclude_ingredients={self.get_product_ids("Свёкла")}'),
+            [self.salad.id])
+
+    def test_pantry_order(self):
+        self.assertEqual(
+            self.get_ids('pantry=' + self.get_product_ids(
+                'Огурец', 'Свёкла', 'Томат', 'Укроп')),
+            [self.salad.id, self.soup.id])
+        self.assertEqual(
+            self.get_ids('pantry=' + self.get_product_ids(
+                'Огурец', 'Свёкла', 'Мука')),
+            [self.soup.id, self.cake.id, self.salad.id])
+
+    def test_filters_after_edit(self):
+        self.edit_soup()
+        self.assertEqual(
+            self.get_ids('has_ingredients='
+                         + self.get_product_ids('Огурец')),
+            [self.salad.id])
+        self.assertEqual(
+            self.get_ids('pantry=' + self.get_product_ids(
+                'Свёкла', 'Огурец', 'Укроп')),
+            [self.salad.id, self.soup.id])
+
+
+class FragmentCacheTest(RecipeTestCase):
+    """Кэшированное представление рецепта сбрасывается при изменениях."""
+
+    def setUp(self):
+        super().setUp()
+        self.create_recipes(1)
+        self.recipe = Recipe.objects.get()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+        self.warm = self.get()
+
+    def get(self, client=None):
+        response = (client or self.client).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def change(self, function):
+        with self.captureOnCommitCallbacks(execute=True):
+            function()
+        return self.get()
+
+    def test_fragment_is_cached(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Без сигналов')
+        self.assertEqual(self.get()['name'], self.warm['name'])
+
+    def test_recipe_save(self):
+        self.recipe.name = 'Новое название'
+        self.assertEqual(
+            self.change(self.recipe.save)['name'], 'Новое название')
+
+    def test_ingredient_row_change(self):
+        row = IngredientInRecipe.objects.filter(recipe=self.recipe).first()
+        row.amount = 100
+        self.assertIn(100, [item['amount'] for item in self.change(
+            row.save)['ingredients']])
+        self.assertEqual(len(self.change(row.delete)['ingredients']),
+                         len(self.ingredients) - 1)
+
+    def test_tags_set(self):
+        data = self.change(lambda: self.recipe.tags.set(self.tags[:1]))
+        self.assertEqual([tag['id'] for tag in data['tags']],
+                         [self.tags[0].id])
+
+    def test_author_profile_save(self):
+        author = self.recipe.author
+        author.first_name = 'Переименованный'
+        self.assertEqual(self.change(author.save)['author']['first_name'],
+                         'Переименованный')
+
+    def test_variants_created(self):
+        def create_variants():
+            Recipe.objects.filter(pk=self.recipe.pk).update(
+                image_thumb='recipes/variants/thumb.webp')
+            variants_created.send(sender=Recipe, recipe_id=self.recipe.id)
+
+        self.assertTrue(
+            self.change(create_variants)['image_thumb'].endswith(
+                'thumb.webp'))
+
+    def test_catalogue_bump(self):
+        tag = self.tags[0]
+        tag.name = 'Переименованный тег'
+        self.assertIn('Переименованный тег',
+                      [tag['name'] for tag in self.change(tag.save)['tags']])
+
+    def test_user_fields_per_viewer(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        other = APIClient()
+        other.force_authenticate(self.authors[1])
+        self.client.force_authenticate(self.user)
+        self.assertTrue(self.get()['is_favorited'])
+        self.assertFalse(self.get(other)['is_favorited'])
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Без сигналов')
+        self.assertEqual(self.get(other)['name'], self.warm['name'])
+
+
+class FavoriteTest(RecipeTestCase):
+    """Добавление в избранное по одному рецепту и пакетом."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.create_recipes(3)
+        self.recipes = list(Recipe.objects.order_by('id'))
+
+    def test_add_is_idempotent(self):
+        url = f'/api/recipes/{self.recipes[0].id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.recipes[0].id)
+        self.assertEqual(Favorite.objects.filter(user=self.user).count(), 1)
+
+    def test_batch_reports_only_added(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        with mock.patch('api.signals.publish_event') as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    '/api/recipes/favorite/',
+                    {'recipes': [recipe.id for recipe in self.recipes]},
+                    format='json')
+        self.assertEqual(response.status_code, 201)
+        publish.assert_called_once_with(
+            [self.user.id], 'favorite',
+            {'action': 'added', 'recipes': mock.ANY})
+        self.assertCountEqual(publish.call_args[0][2]['recipes'],
+                              [recipe.id for recipe in self.recipes[1:]])
+
+    def test_remove_is_idempotent(self):
+        url = f'/api/recipes/{self.recipes[0].id}/favorite/'
+        self.client.post(url)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+
+    def test_batch_delete_without_row_signals(self):
+        Favorite.objects.bulk_create(
+            Favorite(user=self.user, recipe=recipe)
+            for recipe in self.recipes[:2])
+        with mock.patch('api.signals.publish_event') as publish:
+            with mock.patch('api.views.remove_trending') as remove:
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.delete(
+                        '/api/recipes/favorite/',
+                        {'recipes': [recipe.id for recipe in self.recipes]},
+                        format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Favorite.objects.exists())
+        self.assertEqual(
+            sum(Recipe.objects.values_list('favorites_count', flat=True)), 0)
+        publish.assert_called_once_with(
+            [self.user.id], 'favorite',
+            {'action': 'removed', 'recipes': mock.ANY})
+        self.assertCountEqual(publish.call_args[0][2]['recipes'],
+                              [recipe.id for recipe in self.recipes[:2]])
+        remove.assert_called_once()
+        self.assertCountEqual(
+            [recipe_id for recipe_id, _ in remove.call_args[0][1]],
+            [recipe.id for recipe in self.recipes[:2]])
+
+
+class UserRelationsTest(RecipeTestCase):
+    """Фильтры и флаги по снимку связей пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.create_recipes(3)
+        self.recipes = list(Recipe.objects.order_by('id'))
+
+    def get_ids(self, query):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(recipe['id'] for recipe in response.json()['results'])
+
+    def write(self, method, url, data=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300)
+
+    def test_subquery_above_threshold(self):
+        Favorite.objects.bulk_create(
+            Favorite(user=self.user, recipe=recipe)
+            for recipe in self.recipes[:2])
+        expected = [recipe.id for recipe in self.recipes[:2]]
+        for max_ids, subquery in ((10, False), (1, True)):
+            with self.subTest(max_ids=max_ids):
+                cache.clear()
+                with override_settings(USER_RELATIONS_MAX_IDS=max_ids):
+                    with capture_queries() as executed:
+                        self.assertEqual(
+                            self.get_ids('is_favorited=1'), expected)
+                self.assertEqual(
+                    any('EXISTS' in sql and 'recipes_favorite' in sql
+                        for sql, _ in executed),
+                    subquery)
+
+    def test_snapshot_invalidated_by_writes(self):
+        first, second, third = (recipe.id for recipe in self.recipes)
+        for model, query in (('favorite', 'is_favorited=1'),
+                             ('shopping_cart', 'is_in_shopping_cart=1')):
+            with self.subTest(model=model):
+                self.assertEqual(self.get_ids(query), [])
+                self.write('post', f'/api/recipes/{first}/{model}/')
+                self.assertEqual(self.get_ids(query), [first])
+                self.write('post', f'/api/recipes/{model}/',
+                           {'recipes': [second, third]})
+                self.assertEqual(self.get_ids(query), [first, second, third])
+                self.write('delete', f'/api/recipes/{model}/',
+                           {'recipes': [first, second]})
+                self.assertEqual(self.get_ids(query), [third])
+                self.write('delete', f'/api/recipes/{third}/{model}/')
+                self.assertEqual(self.get_ids(query), [])
+
+    def test_snapshot_invalidated_by_subscriptions(self):
+        author = self.authors[0]
+        url = f'/api/recipes/{self.recipes[0].id}/'
+
+        def is_subscribed():
+            return self.client.get(url).json()['author']['is_subscribed']
+
+        self.assertEqual(self.recipes[0].author, author)
+        self.assertFalse(is_subscribed())
+        self.write('post', f'/api/users/{author.id}/subscribe/')
+        self.assertTrue(is_subscribed())
+        self.write('delete', f'/api/users/{author.id}/subscribe/')
+        self.assertFalse(is_subscribed())
+
+
+@override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+class FeedTest(RecipeTestCase):
+    """Лента при переходе автора через FEED_FANOUT_MAX_FOLLOWERS."""
+
+    def subscribe(self, user, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscribe.objects.create(user=user, author=author)
+
+    def unsubscribe(self, user, author):
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscribe.objects.get(user=user, author=author).delete()
+
+    def test_threshold_transition(self):
+        self.create_recipes(3)
+        author = self.authors[0]
+        recipe_id = Recipe.objects.get(author=author).id
+        self.subscribe(self.user, author)
+        self.assertEqual(FeedEntry.objects.filter(author=author).count(), 1)
+        self.subscribe(self.authors[1], author)
+        self.assertFalse(FeedEntry.objects.filter(author=author).exists())
+        self.assertEqual([key[1] for key in get_feed(self.user.id)],
+                         [recipe_id])
+        self.unsubscribe(self.authors[1], author)
+        self.assertEqual(list(FeedEntry.objects.filter(
+            author=author).values_list('user_id', 'recipe_id')),
+            [(self.user.id, recipe_id)])
+
+    def test_fan_out_reads_current_followers(self):
+        author = User.objects.get(pk=self.authors[0].pk)
+        Subscribe.objects.create(user=self.user, author=author)
+        Subscribe.objects.create(user=self.authors[1], author=author)
+        self.assertEqual(author.followers_count, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                author=author, name='Рецепт', text='Описание',
+                image='recipes/images/test.png', cooking_time=10)
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_pulled_author_ignores_pushed_entries(self):
+        self.create_recipes(3)
+        author = self.authors[0]
+        self.subscribe(self.user, author)
+        Subscribe.objects.create(user=self.authors[1], author=author)
+        stale = Recipe.objects.get(author=author)
+        stale.author = self.authors[2]
+        stale.save()
+        self.assertEqual(get_feed(self.user.id), [])
+
+
+@override_settings(SIMILAR_RECIPES_LIMIT=2, SIMILAR_MAX_DF=1)
+class SimilarTest(RecipeTestCase):
+    """Списки похожих рецептов остаются полными после изменений."""
+
+    def setUp(self):
+        super().setUp()
+        self.create_recipes(4)
+        self.recipes = list(Recipe.objects.order_by('id'))
+        refill_similar([recipe.id for recipe in self.recipes])
+
+    def get_neighbours(self, recipe):
+        return set(SimilarRecipe.objects.filter(
+            recipe=recipe).values_list('similar_id', flat=True))
+
+    def test_lists_refilled_after_update(self):
+        # При равной близости в списки попадают рецепты с большим id.
+        changed = self.recipes[-1]
+        changed.tags.clear()
+        IngredientInRecipe.objects.filter(recipe=changed).delete()
+        IngredientInRecipe.objects.create(
+            recipe=changed, ingredient=Ingredient.objects.create(
+                name='Другой ингредиент', measurement_unit='г'), amount=1)
+        update_similar(changed.id)
+        for recipe in self.recipes[:-1]:
+            neighbours = self.get_neighbours(recipe)
+            self.assertEqual(len(neighbours), 2)
+            self.assertNotIn(changed.id, neighbours)
+
+    def test_lists_refilled_after_delete(self):
+        self.create_recipes(1)
+        with mock.patch('recipes.similar.executor', None):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.recipes[-1].delete()
+        for recipe in self.recipes[:-1]:
+            self.assertEqual(len(self.get_neighbours(recipe)), 2)
+
+
+class RecipeImageTest(RecipeTestCase):
+    """Обработка изображения рецепта без фоновых потоков."""
+
+    def test_inline_error_does_not_fail_request(self):
+        patcher = mock.patch('api.signals.schedule_variants',
+                             schedule_variants)
+        with patcher, mock.patch('recipes.images.executor', None):
+            with self.assertLogs('recipes.images', 'ERROR'):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.create_recipes(1)
+        self.assertTrue(Recipe.objects.exists())
+
+
+class JWTAuthTest(RecipeTestCase):
+    """Пользователь JWT из кэша и сброс кэша."""
+
+    def setUp(self):
+        super().setUp()
+        # Классы аутентификации читаются из настроек при импорте API.
+        patcher = mock.patch.object(
+            APIView, 'authentication_classes',
+            [CachedJWTAuthentication, TokenAuthentication])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        access = JWTCreateSerializer.get_token(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def test_cache_has_no_password_hash(self):
+        response = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], self.user.email)
+        cached = cache.get(AUTH_USER_KEY.format(self.user.id))
+        self.assertIsNotNone(cached)
+        self.assertNotIn(self.user.password, repr(cached))
+
+    def test_cached_user_save_keeps_password(self):
+        self.get_me()
+        get_auth_user(self.user.id).save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('pass'))
+
+    def test_token_rejected_after_password_change(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new-pass')
+            self.user.save()
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_token_rejected_after_deactivation(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get_me().status_code, 401)
+
+    def test_logout_invalidates_cache(self):
+        self.get_me()
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(
+            client.post('/api/auth/token/logout/').status_code, 204)
+        self.assertIsNone(cache.get(AUTH_USER_KEY.format(self.user.id)))
+
+
+class EventsTest(RecipeTestCase):
+    """Подключение к потоку событий и рассылка событий."""
+
+    def get_scope(self, query):
+        return {'headers': [], 'query_string': query.encode()}
+
+    def test_ticket(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 201)
+        ticket = response.json()['ticket']
+        self.assertEqual(
+            get_user_id(self.get_scope(f'ticket={ticket}')), self.user.id)
+        with override_settings(EVENTS_TICKET_MAX_AGE=-1):
+            self.assertIsNone(get_ticket_user_id(ticket))
+
+    def test_token_in_query_rejected(self):
+        self.assertIsNone(get_user_id(self.get_scope('token=anything')))
+        self.assertIsNone(get_user_id(self.get_scope('ticket=forged')))
+
+    def test_ticket_requires_authentication(self):
+        self.assertEqual(
+            self.client.post('/api/events/ticket/').status_code, 401)
+
+    def test_publish_continues_after_error(self):
+        broker = mock.Mock()
+        broker.publish.side_effect = [ConnectionError, None, None]
+        with mock.patch('api.events.get_broker', return_value=broker):
+            with self.assertLogs('api.events', 'ERROR'):
+                publish_event([1, 2, 3], 'favorite', {})
+        self.assertEqual(broker.publish.call_count, 3)
+
+    def test_recipe_published_once_to_author_channel(self):
+        for user in (self.user, *self.authors[1:]):
+            Subscribe.objects.create(user=user, author=self.authors[0])
+        broker = mock.Mock()
+        with mock.patch('api.events.get_broker', return_value=broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.create_recipes(1)
+        broker.publish.assert_called_once()
+        channel, message = broker.publish.call_args.args
+        self.assertEqual(channel, get_author_channel(self.authors[0].id))
+        self.assertIn('recipe_published', message)
+
+    def test_stream_channels_include_followed_authors(self):
+        Subscribe.objects.create(user=self.user, author=self.authors[1])
+        self.client.force_authenticate(self.user)
+        ticket = self.client.post('/api/events/ticket/').json()['ticket']
+        self.assertEqual(
+            get_stream_channels(self.get_scope(f'ticket={ticket}')),
+            [get_channel(self.user.id),
+             get_author_channel(self.authors[1].id)])
+        self.assertIsNone(get_stream_channels(self.get_scope('')))
+
+    def test_bearer_token(self):
+        access = str(JWTCreateSerializer.get_token(self.user).access_token)
+        scope = {'headers': [(b'authorization', f'Bearer {access}'.encode())]}
+        with override_settings(JWT_AUTH=True):
+            self.assertEqual(get_user_id(scope), self.user.id)
+            scope['headers'] = [(b'authorization', b'Bearer forged')]
+            self.assertIsNone(get_user_id(scope))
+        with override_settings(JWT_AUTH=False):
+            self.assertIsNone(get_user_id(scope))
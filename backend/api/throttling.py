@@ -0,0 +1,71 @@
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+THROTTLE_KEY = 'throttle:{}:{}'
+
+
+def get_cost(request, view):
+    """
+    Стоимость запроса в токенах: вес маршрута из THROTTLE_COSTS,
+    умноженный на число страниц стандартного размера в ?limit=,
+    но не больше THROTTLE_MAX_PAGES страниц.
+    """
+    match = request.resolver_match
+    cost = settings.THROTTLE_COSTS.get(
+        match.view_name if match else None, settings.THROTTLE_DEFAULT_COST)
+    try:
+        limit = int(request.query_params.get('limit', 0))
+    except ValueError:
+        limit = 0
+    pages = math.ceil(limit / settings.PAGE_SIZE)
+    return cost * min(max(1, pages), settings.THROTTLE_MAX_PAGES)
+
+
+class CostThrottle(BaseThrottle):
+    """
+    Ограничение запросов корзинами токенов. Корзина пользователя
+    (или IP для анонимов) вмещает до THROTTLE_RATES[scope][0] токенов
+    и пополняется со скоростью THROTTLE_RATES[scope][1] токенов
+    в секунду, запрос списывает get_cost токенов. Запросы дороже
+    THROTTLE_HEAVY_COST (выгрузка списка покупок, большие страницы)
+    списывают токены из отдельной корзины scope_heavy, поэтому
+    не исчерпывают корзину обычных запросов того же пользователя.
+
+    Состояние корзины хранится в общем кэше; как и у троттлингов DRF,
+    одновременные запросы могут немного превысить лимит.
+    """
+    timer = time.time
+
+    def allow_request(self, request, view):
+        if request.user.is_authenticated:
+            scope, ident = 'user', request.user.pk
+        else:
+            scope, ident = 'anon', self.get_ident(request)
+        cost = get_cost(request, view)
+        if cost >= settings.THROTTLE_HEAVY_COST:
+            scope = f'{scope}_heavy'
+        capacity, rate = settings.THROTTLE_RATES[scope]
+        cost = min(cost, capacity)
+        key = THROTTLE_KEY.format(scope, ident)
+        now = self.timer()
+        level, updated = cache.get(key, (capacity, now))
+        level = min(capacity, level + (now - updated) * rate)
+        allowed = level >= cost
+        if allowed:
+            level -= cost
+        cache.set(key, (level, now), math.ceil(capacity / rate))
+        self.wait_seconds = 0 if allowed else (cost - level) / rate
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            metrics['throttle_cost'] += cost if allowed else 0
+            metrics['throttled'] += 0 if allowed else 1
+            metrics['throttle_limit'] = capacity
+            metrics['throttle_level'] = level
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
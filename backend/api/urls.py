@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                    events_ticket, metrics)
 
 app_name = 'api'
 
@@ -12,5 +13,7 @@ router_v1.register('tags', TagViewSet)
 router_v1.register('recipes', RecipeViewSet)
 
 urlpatterns = [
+    path('events/ticket/', events_ticket, name='events-ticket'),
+    path('metrics/', metrics, name='metrics'),
     path('', include(router_v1.urls)),
 ]
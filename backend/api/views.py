@@ -1,52 +1,120 @@
 from datetime import datetime
+from functools import partial
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.status import HTTP_400_BAD_REQUEST
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .filters import IngredientFilter, RecipeFilter
-from .pagination import CustomPagination
+from .cache import (get_catalogue_etag, get_catalogue_key,
+                    get_catalogue_last_modified, get_shopping_cart_key)
+from .events import make_ticket
+from .filters import RecipeFilter
+from .metrics import registry
+from .pagination import (CursorPaginationMixin, CustomPagination,
+                         FeedPagination, RecipeCursorPagination)
 from .permissions import IsAdminAuthorOrReadOnly
-from .serializers import (IngredientSerializer, RecipeReadSerializer,
-                          RecipeShortSerializer, RecipeWriteSerializer,
-                          TagSerializer)
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTXTRenderer)
+from .search import ingredient_index
+from .serializers import (IngredientSerializer, RecipeIdsSerializer,
+                          RecipeReadSerializer, RecipeShortSerializer,
+                          RecipeWriteSerializer, TagSerializer)
+from .signals import recipe_relations_changed
+from recipes.feed import get_feed
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, SimilarRecipe, Tag)
+from recipes.trending import remove_trending
+from users.counters import recount
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+catalogue_condition = method_decorator(condition(
+    etag_func=get_catalogue_etag,
+    last_modified_func=get_catalogue_last_modified,
+))
+
+
+class CatalogueViewSet(ReadOnlyModelViewSet):
+    """
+    Базовый вьюсет справочников.
+
+    Отвечает 304 на условные запросы и отдаёт ответы из кэша,
+    пока не изменилась версия справочников.
+    """
+    permission_classes = (AllowAny,)
+    pagination_class = None
+
+    def get_cached_response(self, request, view, *args, **kwargs):
+        key = get_catalogue_key(request.get_full_path())
+        data = cache.get(key)
+        if data is None:
+            data = view(request, *args, **kwargs).data
+            cache.set(key, data, settings.CATALOGUE_CACHE_TIMEOUT)
+        response = Response(data)
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+    @catalogue_condition
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, self.get_list_response, *args, **kwargs)
+
+    @catalogue_condition
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            request, super().retrieve, *args, **kwargs)
+
+    def get_list_response(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+
+class TagViewSet(CatalogueViewSet):
     """Вьюсет для модели тега."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = (AllowAny,)
-    pagination_class = None
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CatalogueViewSet):
     """Вьюсет для модели ингредиента."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    permission_classes = (AllowAny,)
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
-    pagination_class = None
+
+    def get_list_response(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return Response(ingredient_index.search(name))
+        return super().get_list_response(request, *args, **kwargs)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(CursorPaginationMixin, ModelViewSet):
     """Вьюсет для модели рецепта."""
     queryset = Recipe.objects.all()
     permission_classes = (IsAdminAuthorOrReadOnly,)
     pagination_class = CustomPagination
+    cursor_pagination_class = RecipeCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        # Теги и ингредиенты подгружает RecipeReadSerializer только
+        # для рецептов, которых нет в кэше фрагментов, а флаги
+        # пользователя берутся из get_user_relations.
+        return Recipe.objects.select_related('author')
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -77,55 +145,185 @@ class RecipeViewSet(ModelViewSet):
             return self.add_to(ShoppingCart, request.user, pk)
         return self.delete_from(ShoppingCart, request.user, pk)
 
+    @action(detail=True)
+    def similar(self, request, pk):
+        """Рецепты с похожими ингредиентами и тегами."""
+        recipes = [row.similar for row in SimilarRecipe.objects.filter(
+            recipe_id=pk).select_related('similar').order_by('-score')]
+        if not recipes and not Recipe.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response(RecipeShortSerializer(
+            recipes, many=True, context=self.get_serializer_context()).data)
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь."""
+        paginator = FeedPagination()
+        keys = paginator.paginate_keys(
+            partial(get_feed, request.user.id), request)
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for _, recipe_id in keys])
+        serializer = self.get_serializer(
+            [recipes[recipe_id] for _, recipe_id in keys
+             if recipe_id in recipes],
+            many=True,
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def trending(self, request):
+        """
+        Популярные рецепты по убыванию популярности из таблицы,
+        которую пересчитывает refresh_trending, с фильтрами списка.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            trending__isnull=False).order_by('-trending__score', '-id')
+        paginator = CustomPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite',
+        url_name='favorite-batch',
+    )
+    def favorite_batch(self, request):
+        """Метод для пакетного добавления/удаления из избранного."""
+        return self.change_many(Favorite, request)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart',
+        url_name='shopping-cart-batch',
+    )
+    def shopping_cart_batch(self, request):
+        """Метод для пакетного добавления/удаления из списка покупок."""
+        return self.change_many(ShoppingCart, request)
+
     def add_to(self, model, user, pk):
-        """Метод для добавления."""
-        if model.objects.filter(user=user, recipe__id=pk).exists():
-            return Response({'errors': 'Рецепт уже добавлен!'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        """
+        Метод для добавления. Повторное добавление отсекает
+        уникальный индекс, а не предварительная проверка, поэтому
+        одновременные запросы не приводят к ошибке сервера. Запрос
+        идемпотентен: повторное добавление отвечает 200 без изменений.
+        """
         recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
+        try:
+            with transaction.atomic():
+                model.objects.create(user=user, recipe=recipe)
+        except IntegrityError:
+            response_status = status.HTTP_200_OK
+        else:
+            response_status = status.HTTP_201_CREATED
         serializer = RecipeShortSerializer(recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.data, status=response_status)
 
     def delete_from(self, model, user, pk):
-        """Метод для удаления."""
-        obj = model.objects.filter(user=user, recipe__id=pk)
-        if obj.exists():
-            obj.delete()
+        """
+        Метод для удаления. Запрос идемпотентен: удаление рецепта,
+        которого нет в списке, тоже отвечает 204.
+        """
+        model.objects.filter(user=user, recipe_id=pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @transaction.atomic
+    def change_many(self, model, request):
+        """
+        Пакетное добавление одним INSERT с пропуском уже добавленных
+        рецептов или удаление. Повторный запрос ничего не меняет.
+        Новые строки получают общее время created, по нему находятся
+        действительно добавленные рецепты, о которых и сообщается.
+        Удаление идёт одним DELETE без сигналов на каждую строку:
+        счётчики, кэш, события и популярность обновляются один раз
+        для всех удалённых рецептов.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data['recipes']
+        user = request.user
+        if request.method == 'DELETE':
+            queryset = model.objects.filter(user=user, recipe__in=recipes)
+            removed = list(queryset.select_for_update().values_list(
+                'recipe_id', 'created'))
+            if removed:
+                recipe_ids = [recipe_id for recipe_id, _ in removed]
+                queryset._raw_delete(queryset.db)
+                recount(model, {'recipe': recipe_ids})
+                recipe_relations_changed(model, user.id, recipe_ids,
+                                         'removed')
+                transaction.on_commit(
+                    lambda: remove_trending(model, removed))
             return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response({'errors': 'Рецепт уже удален!'},
-                        status=status.HTTP_400_BAD_REQUEST)
+        created = timezone.now()
+        model.objects.bulk_create(
+            [model(user=user, recipe=recipe, created=created)
+             for recipe in recipes],
+            ignore_conflicts=True,
+        )
+        added = list(model.objects.filter(
+            user=user, recipe__in=recipes, created=created,
+        ).values_list('recipe_id', flat=True))
+        if added:
+            recipe_relations_changed(model, user.id, added, 'added')
+        serializer = RecipeShortSerializer(recipes, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(
         detail=False,
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=[ShoppingListTXTRenderer, ShoppingListCSVRenderer,
+                          ShoppingListJSONRenderer],
     )
     def download_shopping_cart(self, request):
         """Метод для скачивания списка покупок."""
         user = request.user
-        if not user.shopping_cart.exists():
-            return Response(status=HTTP_400_BAD_REQUEST)
-        ingredients = IngredientInRecipe.objects.filter(
-            recipes__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        today = datetime.today()
-        shopping_list = (
-            f'Список покупок для: {user.get_full_name()}\n\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
+        ingredients = cache.get_or_set(
+            get_shopping_cart_key(user.id),
+            lambda: list(IngredientInRecipe.objects.filter(
+                recipe__shopping_cart__user=user
+            ).values(
+                'ingredient__name',
+                'ingredient__measurement_unit'
+            ).annotate(amount=Sum('amount')).order_by('ingredient__name')),
+            settings.SHOPPING_CART_CACHE_TIMEOUT,
         )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-        shopping_list += f'\n\nFoodgram ({today:%Y})'
-        filename = f'{user.username}_shopping_list.txt'
-        response = HttpResponse(
-            shopping_list, content_type='text.txt; charset=utf-8'
+        if not ingredients:
+            return Response(status=HTTP_400_BAD_REQUEST)
+        renderer = request.accepted_renderer
+        shopping_list = {
+            'user': user.get_full_name(),
+            'date': datetime.today(),
+            'ingredients': ingredients,
+        }
+        filename = f'{user.username}_shopping_list.{renderer.format}'
+        response = StreamingHttpResponse(
+            renderer.stream(shopping_list),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
         )
         response['Content-Disposition'] = f'attachment; filename={filename}'
         return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def events_ticket(request):
+    """Билет для подключения к потоку событий ?ticket=."""
+    return Response({'ticket': make_ticket(request.user.id)},
+                    status=status.HTTP_201_CREATED)
+
+
+def metrics(request):
+    """Метрики запросов в текстовом формате Prometheus."""
+    token = settings.METRICS_TOKEN
+    if not token or not constant_time_compare(
+            request.headers.get('Authorization', ''), f'Bearer {token}'):
+        raise Http404
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
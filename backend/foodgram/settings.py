@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -35,6 +36,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,14 +87,35 @@ DATABASES = {
     }
 }
 
+# Сброс кэша виден другим процессам только в общем кэше (memcached
+# в docker-compose); LocMemCache - для разработки в одном процессе.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# JWT включается переменной окружения и работает вместе с токенами
+# DRF, пока клиенты переходят на /api/auth/jwt/.
+JWT_AUTH = os.getenv('JWT_AUTH', '0') == '1'
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        *(['api.authentication.CachedJWTAuthentication'] if JWT_AUTH else []),
         'rest_framework.authentication.TokenAuthentication',
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'api.throttling.CostThrottle',
+    ],
     "DEFAULT_PAGINATION_CLASS": "api.pagination.CustomPagination",
+    # Перед приложением стоит nginx: адрес клиента берётся
+    # из X-Forwarded-For, который он дополняет.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
 }
 
 DJOSER = {
@@ -108,6 +131,14 @@ DJOSER = {
     },
 }
 
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(
+        minutes=int(os.getenv('JWT_ACCESS_MINUTES', 5))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'AUTH_HEADER_TYPES': ('Bearer',),
+}
+JWT_USER_CACHE_TIMEOUT = int(os.getenv('JWT_USER_CACHE_TIMEOUT', 300))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -149,5 +180,74 @@ RECIPES_MAX_LENGTH = 200
 UNIT_MAX_LENGTH = 100
 COLOR_MAX_LENGTH = 7
 PAGE_SIZE = 6
+PAGINATION_QUERY_PARAM = 'pagination'
 ROLE_MAX_LENGTH = 10
 TAG_MAX_LENGTH = 50
+SHOPPING_CART_CACHE_TIMEOUT = 60 * 60 * 24
+INGREDIENT_SEARCH_LIMIT = 20
+INGREDIENT_FUZZY_MIN_LENGTH = 3
+CATALOGUE_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+CATALOGUE_VERSION_TIMEOUT = 5
+RECIPE_IMAGE_VARIANTS_DIR = 'recipes/images/variants'
+RECIPE_IMAGE_WIDTHS = {'image_thumb': 320, 'image_medium': 640}
+RECIPE_IMAGE_QUALITY = 80
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_SERVER_TIMING = True
+RECIPE_SEARCH_CONFIG = 'russian'
+RECIPE_BATCH_MAX_SIZE = 100
+RECIPE_FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+USER_RELATIONS_CACHE_TIMEOUT = 60 * 60
+# Больше стольких id из снимка связей фильтр по избранному и корзине
+# передаёт базе подзапросом, а не списком параметров.
+USER_RELATIONS_MAX_IDS = 500
+# SQLite допускает одного писателя: фоновый поток с транзакцией
+# блокирует запись в запросах, поэтому по умолчанию работа с лентами
+# и похожими рецептами выполняется в запросе.
+BACKGROUND_WORKERS = 0 if 'sqlite' in DATABASES['default']['ENGINE'] else 1
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_WORKERS = int(os.getenv('FEED_WORKERS', BACKGROUND_WORKERS))
+FEED_BACKFILL_SIZE = 100
+FEED_BATCH_SIZE = 1000
+SIMILAR_RECIPES_LIMIT = 10
+SIMILAR_TAG_WEIGHT = 0.5
+SIMILAR_MAX_DF = 0.05
+SIMILAR_MAX_CANDIDATES = 2000
+SIMILAR_WORKERS = int(os.getenv('SIMILAR_WORKERS', BACKGROUND_WORKERS))
+# Популярность: период полураспада вклада добавления в секундах.
+TRENDING_HALF_LIFE = 60 * 60 * 24 * 3
+TRENDING_FAVORITE_WEIGHT = 1
+TRENDING_SHOPPING_CART_WEIGHT = 0.5
+TRENDING_MIN_SCORE = 0.05
+TRENDING_REFRESH_LAG = 60
+TRENDING_BATCH_SIZE = 1000
+# Корзины троттлинга: (ёмкость в токенах, пополнение в токенах в секунду).
+THROTTLE_RATES = {
+    'user': (120, 2),
+    'anon': (60, 1),
+    'user_heavy': (100, 0.5),
+    'anon_heavy': (40, 0.2),
+}
+THROTTLE_DEFAULT_COST = 1
+THROTTLE_HEAVY_COST = 10
+THROTTLE_MAX_PAGES = 10
+THROTTLE_COSTS = {
+    'api:recipe-list': 2,
+    'api:recipe-feed': 2,
+    'api:recipe-trending': 2,
+    'api:recipe-download-shopping-cart': 20,
+    'api:recipe-favorite-batch': 5,
+    'api:recipe-shopping-cart-batch': 5,
+    'users:user-subscriptions': 10,
+}
+EVENTS_PATH = '/api/events/'
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'api.events.LocalBroker')
+EVENTS_BROKER_URL = os.getenv('EVENTS_BROKER_URL', 'redis://localhost:6379/0')
+EVENTS_CHANNEL_PREFIX = 'foodgram:events:'
+EVENTS_KEEPALIVE = 15
+EVENTS_RETRY_MS = 3000
+EVENTS_QUEUE_SIZE = 100
+EVENTS_TICKET_MAX_AGE = 60
@@ -17,16 +17,13 @@ class RecipeAdmin(admin.ModelAdmin):
         'id',
         'name',
         'author',
-        'added_in_favorites',
+        'favorites_count',
+        'shopping_cart_count',
         'pub_date',
     )
     list_filter = ('name', 'author', 'tags',)
     search_fields = ['name']
 
-    @admin.display(description='В избранном')
-    def added_in_favorites(self, obj):
-        return obj.favorites.all().count()
-
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
@@ -53,20 +50,20 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(IngredientInRecipe)
 class IngredientInRecipeAdmin(admin.ModelAdmin):
     """Кастомизация админ панели - данные про ингредиенты в рецептах."""
-    list_display = ('ingredient', 'amount')
-    search_fields = ['ingredient']
+    list_display = ('recipe', 'ingredient', 'amount')
+    search_fields = ['recipe__name', 'ingredient__name']
     list_filter = ('ingredient',)
 
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     """Кастомизация админ панели - данные про избранные рецепты."""
-    list_display = ('id', 'user', 'recipe')
+    list_display = ('id', 'user', 'recipe', 'created')
     search_fields = ['user', 'recipe']
 
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     """Кастомизация админ панели - данные про список покупок."""
-    list_display = ('id', 'user', 'recipe')
+    list_display = ('id', 'user', 'recipe', 'created')
     search_fields = ['user', 'recipe']
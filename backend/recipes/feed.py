@@ -0,0 +1,188 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from .models import FeedEntry, Recipe
+from users.models import Subscribe, User
+
+logger = logging.getLogger(__name__)
+
+executor = (ThreadPoolExecutor(max_workers=settings.FEED_WORKERS,
+                               thread_name_prefix='feed')
+            if settings.FEED_WORKERS else None)
+
+
+def get_followers_count(author_id):
+    """Текущее число подписчиков автора из базы."""
+    return User.objects.filter(pk=author_id).values_list(
+        'followers_count', flat=True).first() or 0
+
+
+def is_pushed(author_id):
+    """
+    Рецепты автора раскладываются по лентам подписчиков при публикации,
+    если подписчиков не больше FEED_FANOUT_MAX_FOLLOWERS. Рецепты
+    остальных авторов подмешиваются в ленту при чтении. Число
+    подписчиков читается из базы: у объекта автора оно может быть
+    устаревшим.
+    """
+    return (get_followers_count(author_id)
+            <= settings.FEED_FANOUT_MAX_FOLLOWERS)
+
+
+def fan_out(recipe_id, author_id, pub_date):
+    """Добавляет опубликованный рецепт в ленты подписчиков автора."""
+    if not is_pushed(author_id):
+        return
+    followers = Subscribe.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)
+    FeedEntry.objects.bulk_create(
+        [FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                   author_id=author_id, pub_date=pub_date)
+         for user_id in followers.iterator()],
+        batch_size=settings.FEED_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def get_recent_recipes(author_id):
+    """Ключи (id, pub_date) последних FEED_BACKFILL_SIZE рецептов автора."""
+    return list(Recipe.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-id').values_list(
+            'id', 'pub_date')[:settings.FEED_BACKFILL_SIZE])
+
+
+def make_entries(author_id, recipes, user_ids):
+    """Записи лент пользователей user_ids для рецептов автора."""
+    return [FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+            for recipe_id, pub_date in recipes for user_id in user_ids]
+
+
+def follow(user_id, author_id):
+    """
+    Добавляет в ленту последние рецепты нового автора. Если с новым
+    подписчиком автор перешёл к подмешиванию при чтении, его записи
+    удаляются из всех лент.
+    """
+    if not is_pushed(author_id):
+        FeedEntry.objects.filter(author_id=author_id).delete()
+        return
+    FeedEntry.objects.bulk_create(
+        make_entries(author_id, get_recent_recipes(author_id), [user_id]),
+        ignore_conflicts=True,
+    )
+
+
+def unfollow(user_id, author_id):
+    """
+    Убирает из ленты рецепты автора. Если после отписки рецепты
+    автора снова раскладываются по лентам, а записей автора нет
+    (они удалены при переходе к подмешиванию), его последние рецепты
+    добавляются в ленты всех подписчиков.
+    """
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+    if (not is_pushed(author_id)
+            or FeedEntry.objects.filter(author_id=author_id).exists()):
+        return
+    recipes = get_recent_recipes(author_id)
+    if not recipes:
+        return
+    followers = list(Subscribe.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True))
+    step = max(1, settings.FEED_BATCH_SIZE // len(recipes))
+    for start in range(0, len(followers), step):
+        FeedEntry.objects.bulk_create(
+            make_entries(author_id, recipes, followers[start:start + step]),
+            ignore_conflicts=True,
+        )
+
+
+def rebuild_feeds(user_ids):
+    """
+    Собирает ленты пользователей заново: по FEED_BACKFILL_SIZE
+    последних рецептов каждого автора, рецепты которого
+    раскладываются по лентам.
+    """
+    FeedEntry.objects.filter(user_id__in=user_ids).delete()
+    subscriptions = Subscribe.objects.filter(
+        user_id__in=user_ids,
+        author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).values_list('user_id', 'author_id')
+    followers = {}
+    for user_id, author_id in subscriptions:
+        followers.setdefault(author_id, []).append(user_id)
+    entries = []
+    for author_id, user_ids in followers.items():
+        entries.extend(make_entries(
+            author_id, get_recent_recipes(author_id), user_ids))
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=settings.FEED_BATCH_SIZE, ignore_conflicts=True)
+    return len(entries)
+
+
+def process_feed(function, *args):
+    """Изменяет ленты; ошибка записывается в журнал."""
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Не удалось обновить ленты: %s%s',
+                         function.__name__, args)
+
+
+def process_feed_in_background(function, *args):
+    """Изменяет ленты в фоновом потоке."""
+    try:
+        process_feed(function, *args)
+    finally:
+        close_old_connections()
+
+
+def schedule_feed(function, *args):
+    """
+    Изменяет ленты после фиксации транзакции: раскладка рецепта
+    по тысячам лент не задерживает ответ. С FEED_WORKERS=0
+    выполняется в самом запросе.
+    """
+    if executor is None:
+        transaction.on_commit(lambda: process_feed(function, *args))
+    else:
+        transaction.on_commit(
+            lambda: executor.submit(process_feed_in_background, function,
+                                    *args))
+
+
+def before(position, id_field):
+    """Условие (pub_date, id) < position для пагинации по ключу."""
+    if position is None:
+        return Q()
+    pub_date, recipe_id = position
+    return (Q(pub_date__lt=pub_date)
+            | Q(pub_date=pub_date, **{f'{id_field}__lt': recipe_id}))
+
+
+def get_feed(user_id, position=None, limit=settings.PAGE_SIZE):
+    """
+    Ключи (pub_date, id) рецептов ленты пользователя, начиная после
+    position, по убыванию. Записи ленты и рецепты авторов, которые
+    подмешиваются при чтении, выбираются по индексам и сливаются;
+    оставшиеся записи таких авторов не учитываются.
+    """
+    pulled = list(Subscribe.objects.filter(
+        user_id=user_id,
+        author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).values_list('author_id', flat=True))
+    keys = set(FeedEntry.objects.filter(
+        before(position, 'recipe_id'), user_id=user_id,
+    ).exclude(author_id__in=pulled).order_by(
+        '-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id')[:limit])
+    if pulled:
+        keys.update(Recipe.objects.filter(
+            before(position, 'id'), author_id__in=pulled,
+        ).order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id')[:limit])
+    return sorted(keys, reverse=True)[:limit]
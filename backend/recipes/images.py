@@ -0,0 +1,101 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+from PIL import Image, features
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+# Отправляется после сохранения уменьшенных копий: обновление
+# выполняется через QuerySet.update и не вызывает post_save.
+variants_created = Signal()
+
+IMAGE_FORMAT, IMAGE_EXTENSION = (
+    ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg'))
+
+executor = (ThreadPoolExecutor(max_workers=settings.RECIPE_IMAGE_WORKERS,
+                               thread_name_prefix='recipe-images')
+            if settings.RECIPE_IMAGE_WORKERS else None)
+
+
+def get_variant_name(image_name, width):
+    """Имя файла уменьшенной копии изображения заданной ширины."""
+    path = PurePosixPath(image_name)
+    return (f'{settings.RECIPE_IMAGE_VARIANTS_DIR}/'
+            f'{path.stem}{path.suffix.replace(".", "_")}_{width}'
+            f'.{IMAGE_EXTENSION}')
+
+
+def has_current_variants(recipe):
+    """Проверяет, что уменьшенные копии сделаны из текущего изображения."""
+    return all(
+        getattr(recipe, field).name == get_variant_name(
+            recipe.image.name, width)
+        for field, width in settings.RECIPE_IMAGE_WIDTHS.items()
+    )
+
+
+def resize(image, width):
+    """Уменьшает изображение до заданной ширины без увеличения."""
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.LANCZOS)
+    if IMAGE_FORMAT == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    content = BytesIO()
+    image.save(content, IMAGE_FORMAT, quality=settings.RECIPE_IMAGE_QUALITY)
+    return ContentFile(content.getvalue())
+
+
+def make_variants(recipe_id):
+    """Создаёт уменьшенные копии изображения рецепта."""
+    recipe = Recipe.objects.filter(id=recipe_id).only('id', 'image').first()
+    if recipe is None or not recipe.image:
+        return
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image.load()
+    variants = {}
+    for field, width in settings.RECIPE_IMAGE_WIDTHS.items():
+        name = get_variant_name(recipe.image.name, width)
+        default_storage.delete(name)
+        variants[field] = default_storage.save(name, resize(image, width))
+    if Recipe.objects.filter(
+        id=recipe_id, image=recipe.image.name,
+    ).update(**variants):
+        variants_created.send(sender=Recipe, recipe_id=recipe_id)
+
+
+def make_variants_logged(recipe_id):
+    """Создаёт уменьшенные копии; ошибка записывается в журнал."""
+    try:
+        make_variants(recipe_id)
+        return True
+    except Exception:
+        logger.exception(
+            'Не удалось обработать изображение рецепта %s', recipe_id)
+        return False
+
+
+def process_recipe_image(recipe_id):
+    """Обрабатывает изображение в фоновом потоке."""
+    try:
+        return make_variants_logged(recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(recipe):
+    """Ставит обработку изображения в очередь после фиксации транзакции."""
+    if executor is None:
+        transaction.on_commit(lambda: make_variants_logged(recipe.id))
+    else:
+        transaction.on_commit(
+            lambda: executor.submit(process_recipe_image, recipe.id))
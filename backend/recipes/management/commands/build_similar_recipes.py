@@ -0,0 +1,56 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from recipes.models import SimilarRecipe
+from recipes.similar import find_neighbours, init_worker, make_rows, prepare
+
+
+class Command(BaseCommand):
+    """
+    Команда 'build_similar_recipes' пересчитывает похожие рецепты:
+    строит векторы TF-IDF по ингредиентам и тегам, ищет соседей
+    каждого рецепта в пуле процессов и заменяет таблицу соседей
+    одной транзакцией.
+    """
+    help = 'Пересчитывает похожие рецепты.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='Число процессов; 0 - считать в текущем процессе.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        vectors, index = prepare()
+        recipe_ids = list(vectors)
+        chunk_size = options['chunk_size']
+        chunks = [recipe_ids[start:start + chunk_size]
+                  for start in range(0, len(recipe_ids), chunk_size)]
+        if options['workers']:
+            # Процессы пула не работают с базой, а унаследованные
+            # соединения нельзя использовать из нескольких процессов.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                options['workers'], initializer=init_worker,
+                initargs=(vectors, index),
+            ) as pool:
+                results = list(pool.map(find_neighbours, chunks))
+        else:
+            init_worker(vectors, index)
+            results = [find_neighbours(chunk) for chunk in chunks]
+        rows = [row for result in results
+                for recipe_id, neighbours in result
+                for row in make_rows(recipe_id, neighbours)]
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            SimilarRecipe.objects.bulk_create(
+                rows, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {len(recipe_ids)}, пар соседей: {len(rows)} '
+            f'за {time.monotonic() - started:.1f} с.'))
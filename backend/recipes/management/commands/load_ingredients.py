@@ -1,28 +1,116 @@
 import csv
+import json
+import time
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from api.cache import bump_catalogue_version
 from recipes.models import Ingredient
 
 
+def normalize(ingredient):
+    """Убирает лишние пробелы в названии и единице измерения."""
+    return tuple(' '.join(value.split()) for value in ingredient)
+
+
 class Command(BaseCommand):
     """
     Команда 'load_ingredients' загружает ингредиенты
-    в базу из csv файла, который располагается в
+    в базу из csv или json файла, по умолчанию из
     директории /data/.
+    Повторный запуск с теми же данными ничего не меняет.
     """
+    help = 'Загружает ингредиенты из csv или json файла.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=Path(settings.BASE_DIR) / 'data' / 'ingredients.csv',
+            type=Path,
+            help='Путь к файлу с ингредиентами.',
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном запросе.',
+        )
 
     def handle(self, *args, **options):
-        self.import_ingredients()
-        print('Загрузка ингредиентов завершена.')
-
-    def import_ingredients(self, file='ingredients.csv'):
-        print(f'Загрузка {file}...')
-        file_path = f'./data/{file}'
-        with open(file_path, newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                status, created = Ingredient.objects.update_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+        path = options['path']
+        file_format = options['format'] or path.suffix.lstrip('.')
+        if file_format not in ('csv', 'json'):
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        self.stdout.write(f'Загрузка {path}...')
+        started = time.monotonic()
+        ingredients = {}
+        for name, measurement_unit in self.read(path, file_format):
+            key = normalize((name, measurement_unit))
+            if all(key):
+                ingredients[key] = True
+        total = len(ingredients)
+        inserted, updated, unchanged = self.import_ingredients(
+            ingredients, options['batch_size'])
+        elapsed = time.monotonic() - started
+        bump_catalogue_version()
+        self.stdout.write(self.style.SUCCESS(
+            f'Загрузка ингредиентов завершена: добавлено {inserted}, '
+            f'обновлено {updated}, без изменений {unchanged} '
+            f'за {elapsed:.2f} с '
+            f'({total / max(elapsed, 1e-6):.0f} строк/с).'
+        ))
+
+    def read(self, path, file_format):
+        """Построчно читает пары (название, единица измерения)."""
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                if file_format == 'json':
+                    for item in json.load(f):
+                        yield item['name'], item['measurement_unit']
+                else:
+                    for row in csv.reader(f):
+                        if len(row) >= 2:
+                            yield row[0], row[1]
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            raise CommandError(f'Не удалось прочитать {path}: {error}')
+
+    @transaction.atomic
+    def import_ingredients(self, ingredients, batch_size):
+        """Добавляет новые ингредиенты и исправляет написание старых."""
+        existing = Ingredient.objects.only(
+            'id', 'name', 'measurement_unit')
+        spelled = {(ingredient.name, ingredient.measurement_unit)
+                   for ingredient in existing}
+        to_update = []
+        unchanged = 0
+        for ingredient in existing:
+            current = (ingredient.name, ingredient.measurement_unit)
+            key = normalize(current)
+            if key not in ingredients:
+                continue
+            if current != key and key in spelled:
+                continue
+            del ingredients[key]
+            if current == key:
+                unchanged += 1
+                continue
+            ingredient.name, ingredient.measurement_unit = key
+            to_update.append(ingredient)
+        Ingredient.objects.bulk_update(
+            to_update, ('name', 'measurement_unit'), batch_size=batch_size)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in ingredients],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        return len(ingredients), len(to_update), unchanged
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.images import has_current_variants, process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Команда 'make_recipe_images' создаёт уменьшенные копии
+    изображений для рецептов, у которых их ещё нет.
+    """
+    help = 'Создаёт уменьшенные копии изображений рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.RECIPE_IMAGE_WORKERS or 1,
+            help='Количество потоков обработки.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Пересоздать копии для всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        recipe_ids = [
+            recipe.id
+            for recipe in Recipe.objects.only(
+                'id', 'image', 'image_thumb', 'image_medium').iterator()
+            if recipe.image
+            and (options['force'] or not has_current_variants(recipe))
+        ]
+        self.stdout.write(f'Обработка изображений: {len(recipe_ids)}...')
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            done = sum(executor.map(process_recipe_image, recipe_ids))
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done}, с ошибками: {len(recipe_ids) - done}.'))
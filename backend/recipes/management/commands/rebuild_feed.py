@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.feed import rebuild_feeds
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_feed' заполняет ленты подписчиков пачками
+    пользователей: после первого развёртывания ленты и после смены
+    FEED_FANOUT_MAX_FOLLOWERS или FEED_BACKFILL_SIZE.
+    """
+    help = 'Пересобирает ленты рецептов подписчиков.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Число пользователей в пачке.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = User.objects.filter(
+            follower__isnull=False,
+        ).distinct().order_by('pk').values_list('pk', flat=True)
+        users = entries = 0
+        last_pk = None
+        while True:
+            batch = user_ids if last_pk is None else user_ids.filter(
+                pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            with transaction.atomic():
+                entries += rebuild_feeds(batch)
+            users += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Собрано лент: {users}, записей: {entries}'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import Recipe
+from recipes.search import update_search_index
+
+
+class Command(BaseCommand):
+    """
+    Команда 'rebuild_search_index' пересобирает полнотекстовый индекс
+    рецептов пачками, например после правки ингредиентов в админке.
+    """
+    help = 'Пересобирает полнотекстовый индекс рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True))
+        batch_size = options['batch_size']
+        for start in range(0, len(recipe_ids), batch_size):
+            with transaction.atomic():
+                update_search_index(recipe_ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(
+            f'Проиндексировано рецептов: {len(recipe_ids)}'))
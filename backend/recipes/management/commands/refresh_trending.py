@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import TrendingRecipe
+from recipes.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    """
+    Команда 'refresh_trending' учитывает в популярности рецептов
+    добавления в избранное и в списки покупок с прошлого запуска.
+    Запускается по расписанию, например раз в несколько минут из cron.
+    """
+    help = 'Обновляет популярность рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать по всем добавлениям, например после '
+                 'смены TRENDING_HALF_LIFE или весов.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        events = refresh_trending(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Учтено добавлений: {events}, популярных рецептов: '
+            f'{TrendingRecipe.objects.count()} '
+            f'за {time.monotonic() - started:.1f} с.'))
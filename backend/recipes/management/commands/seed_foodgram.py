@@ -0,0 +1,198 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.feed import rebuild_feeds
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import update_ingredient_sets, update_search_index
+from recipes.trending import refresh_trending
+from users.models import Subscribe
+
+User = get_user_model()
+
+TAGS = (
+    ('Завтрак', 'breakfast', '#E26C2D'),
+    ('Обед', 'lunch', '#49B64E'),
+    ('Ужин', 'dinner', '#8775D2'),
+    ('Десерт', 'dessert', '#F0C330'),
+    ('Выпечка', 'bakery', '#A0522D'),
+)
+PASSWORD = 'foodgram-seed'
+
+
+def zipf_weights(count, exponent=1.1):
+    """
+    Накопленные веса распределения Ципфа: немногие элементы
+    популярнее прочих.
+    """
+    return list(accumulate(
+        1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def sample(population, weights, count):
+    """Выбирает count разных элементов с учётом накопленных весов."""
+    count = min(count, len(population))
+    chosen = set()
+    while len(chosen) < count:
+        chosen.update(random.choices(
+            population, cum_weights=weights, k=count - len(chosen)))
+    return chosen
+
+
+class Command(BaseCommand):
+    """
+    Команда 'seed_foodgram' заполняет базу синтетическими данными:
+    пользователями, рецептами, избранным, корзинами и подписками.
+    Популярность ингредиентов, рецептов и авторов распределена
+    по закону Ципфа.
+    """
+    help = 'Заполняет базу синтетическими данными для нагрузочных тестов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных на пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Среднее число рецептов в корзине.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок на пользователя.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', stdout=self.stdout)
+        tags = self.create_tags()
+        users = self.create_users(options['users'])
+        recipes = self.create_recipes(users, tags, options['recipes'])
+        self.create_relations(Favorite, users, recipes,
+                              options['favorites'])
+        self.create_relations(ShoppingCart, users, recipes, options['cart'])
+        self.create_subscriptions(users, options['subscriptions'])
+        refresh_trending(full=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, рецептов: {len(recipes)} '
+            f'за {time.monotonic() - started:.1f} с. '
+            f'Пароль пользователей: {PASSWORD}'
+        ))
+
+    def create_tags(self):
+        for name, slug, color in TAGS:
+            Tag.objects.get_or_create(
+                slug=slug, defaults={'name': name, 'color': color})
+        return list(Tag.objects.values_list('id', flat=True))
+
+    def create_users(self, count):
+        prefix = f'seed{int(time.time())}'
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            [User(username=f'{prefix}_{number}',
+                  email=f'{prefix}_{number}@example.com',
+                  first_name='Тест',
+                  last_name=f'Пользователь {number}',
+                  password=password)
+             for number in range(count)],
+            batch_size=self.batch_size,
+        )
+        return list(User.objects.filter(
+            username__startswith=f'{prefix}_').values_list('id', flat=True))
+
+    def create_image(self):
+        content = BytesIO()
+        Image.new('RGB', (1200, 800), '#E26C2D').save(content, 'JPEG')
+        return default_storage.save(
+            'recipes/images/seed.jpg', ContentFile(content.getvalue()))
+
+    def create_recipes(self, users, tags, count):
+        image = self.create_image()
+        authors = random.choices(
+            users, cum_weights=zipf_weights(len(users)), k=count)
+        Recipe.objects.bulk_create(
+            [Recipe(author_id=author_id,
+                    name=f'Рецепт {number}',
+                    text='Описание рецепта для нагрузочного теста.',
+                    image=image,
+                    cooking_time=random.randint(5, 180))
+             for number, author_id in enumerate(authors)],
+            batch_size=self.batch_size,
+        )
+        recipes = list(Recipe.objects.filter(
+            image=image).order_by('-id')[:count])
+        now = timezone.now()
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                minutes=random.randint(0, 60 * 24 * 365))
+        Recipe.objects.bulk_update(
+            recipes, ('pub_date',), batch_size=self.batch_size)
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        random.shuffle(ingredients)
+        weights = zipf_weights(len(ingredients))
+        rows = []
+        links = []
+        for recipe in recipes:
+            for ingredient_id in sample(ingredients, weights,
+                                        random.randint(3, 12)):
+                rows.append(IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=random.randint(1, 500),
+                ))
+            for tag_id in random.sample(tags, random.randint(1, 2)):
+                links.append(Recipe.tags.through(
+                    recipe_id=recipe.id, tag_id=tag_id))
+        IngredientInRecipe.objects.bulk_create(
+            rows, batch_size=self.batch_size)
+        Recipe.tags.through.objects.bulk_create(
+            links, batch_size=self.batch_size)
+        recipe_ids = [recipe.id for recipe in recipes]
+        for start in range(0, len(recipe_ids), self.batch_size):
+            batch = recipe_ids[start:start + self.batch_size]
+            update_search_index(batch)
+            update_ingredient_sets(batch)
+        return recipe_ids
+
+    def create_relations(self, model, users, recipes, average):
+        weights = zipf_weights(len(recipes))
+        now = timezone.now()
+        model.objects.bulk_create(
+            [model(user_id=user_id, recipe_id=recipe_id,
+                   created=now - timedelta(
+                       minutes=random.randint(1, 60 * 24 * 30)))
+             for user_id in users
+             for recipe_id in sample(
+                 recipes, weights, random.randint(0, 2 * average))],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+
+    def create_subscriptions(self, users, average):
+        weights = zipf_weights(len(users))
+        Subscribe.objects.bulk_create(
+            [Subscribe(user_id=user_id, author_id=author_id)
+             for user_id in users
+             for author_id in sample(
+                 users, weights, random.randint(0, 2 * average))
+             if author_id != user_id],
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        for start in range(0, len(users), self.batch_size):
+            rebuild_feeds(users[start:start + self.batch_size])
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='ingredientinrecipe',
+            name='unique_ingredient_in_recipe',
+        ),
+        migrations.AddField(
+            model_name='ingredientinrecipe',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+def split_shared_rows(apps, schema_editor):
+    """Создаёт отдельную строку ингредиента для каждого рецепта."""
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    amounts = {}
+    links = Recipe.ingredients.through.objects.select_related(
+        'ingredientinrecipe')
+    for link in links.iterator():
+        key = (link.recipe_id, link.ingredientinrecipe.ingredient_id)
+        amounts[key] = (amounts.get(key, 0)
+                        + link.ingredientinrecipe.amount)
+    IngredientInRecipe.objects.bulk_create(
+        [IngredientInRecipe(recipe_id=recipe_id,
+                            ingredient_id=ingredient_id,
+                            amount=amount)
+         for (recipe_id, ingredient_id), amount in amounts.items()],
+        batch_size=1000,
+    )
+    IngredientInRecipe.objects.filter(recipe__isnull=True).delete()
+
+
+def join_shared_rows(apps, schema_editor):
+    """Возвращает общие строки (ингредиент, количество) для рецептов."""
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Through = Recipe.ingredients.through
+    shared = {}
+    links = []
+    rows = IngredientInRecipe.objects.filter(recipe__isnull=False)
+    for row in rows.iterator():
+        key = (row.ingredient_id, row.amount)
+        if key not in shared:
+            shared[key] = IngredientInRecipe.objects.create(
+                ingredient_id=row.ingredient_id, amount=row.amount)
+        links.append(Through(recipe_id=row.recipe_id,
+                             ingredientinrecipe_id=shared[key].id))
+    Through.objects.bulk_create(links, batch_size=1000)
+    rows.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredientinrecipe_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_shared_rows, join_shared_rows),
+    ]
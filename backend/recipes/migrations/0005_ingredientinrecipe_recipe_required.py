@@ -0,0 +1,27 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_split_ingredient_rows'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients',
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredients', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientinrecipe',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique_ingredient_in_recipe'),
+        ),
+    ]
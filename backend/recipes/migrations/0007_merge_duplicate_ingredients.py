@@ -0,0 +1,42 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:09
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Объединяет ингредиенты с одинаковым названием и единицей."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        extra = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=keep_id)
+        for row in IngredientInRecipe.objects.filter(ingredient__in=extra):
+            kept = IngredientInRecipe.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=keep_id).first()
+            if kept is None:
+                row.ingredient_id = keep_id
+                row.save(update_fields=('ingredient',))
+            else:
+                kept.amount += row.amount
+                kept.save(update_fields=('amount',))
+                row.delete()
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_medium',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/variants', verbose_name='Изображение среднего размера'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumb',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/variants', verbose_name='Миниатюра изображения'),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:19
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+# SQL зафиксирован в миграции, а не импортируется из recipes.search,
+# чтобы последующие правки поиска не меняли уже применённую миграцию.
+INGREDIENT_NAMES_SQL = (
+    "SELECT {aggregate} FROM recipes_ingredientinrecipe AS link "
+    "JOIN recipes_ingredient AS ingredient "
+    "ON ingredient.id = link.ingredient_id "
+    "WHERE link.recipe_id = recipe.id"
+)
+YO_SQL = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+CREATE_SQL = {
+    'postgresql': (
+        'CREATE INDEX recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)'
+    ),
+    'sqlite': (
+        'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+        'name, text, ingredients, '
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    ),
+}
+FILL_SQL = {
+    'postgresql': (
+        "UPDATE recipes_recipe AS recipe SET search_vector = "
+        "setweight(to_tsvector(%s::regconfig, recipe.name), 'A') || "
+        "setweight(to_tsvector(%s::regconfig, recipe.text), 'B') || "
+        "setweight(to_tsvector(%s::regconfig, coalesce(("
+        + INGREDIENT_NAMES_SQL.format(
+            aggregate="string_agg(ingredient.name, ' ')")
+        + "), '')), 'C')"
+    ),
+    'sqlite': (
+        "INSERT INTO recipes_recipe_fts (rowid, name, text, ingredients) "
+        "SELECT recipe.id, "
+        + YO_SQL.format('recipe.name') + ", "
+        + YO_SQL.format('recipe.text') + ", "
+        + YO_SQL.format('(' + INGREDIENT_NAMES_SQL.format(
+            aggregate="group_concat(ingredient.name, ' ')") + ')')
+        + " FROM recipes_recipe AS recipe"
+    ),
+}
+DROP_SQL = {
+    'postgresql': 'DROP INDEX IF EXISTS recipe_search_vector_idx',
+    'sqlite': 'DROP TABLE IF EXISTS recipes_recipe_fts',
+}
+
+
+def create_index(apps, schema_editor):
+    """
+    GIN-индекс и таблица FTS5 зависят от СУБД, поэтому создаются
+    SQL-запросом, а не через Meta.indexes; на других СУБД поиск
+    работает без индекса.
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    schema_editor.execute(CREATE_SQL[vendor])
+    schema_editor.execute(FILL_SQL[vendor], (
+        [settings.RECIPE_SEARCH_CONFIG] * 3 if vendor == 'postgresql'
+        else ()))
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor in DROP_SQL:
+        schema_editor.execute(DROP_SQL[vendor])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
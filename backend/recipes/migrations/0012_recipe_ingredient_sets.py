@@ -0,0 +1,45 @@
+from django.db import migrations
+
+# Столбец recipes_recipe.ingredient_ids описан в комментарии к модели
+# Recipe. SQL зафиксирован в миграции, а не импортируется
+# из recipes.search.
+CREATE_SQL = (
+    "ALTER TABLE recipes_recipe "
+    "ADD COLUMN ingredient_ids bigint[] NOT NULL DEFAULT '{}'",
+    "UPDATE recipes_recipe AS recipe SET ingredient_ids = array("
+    "SELECT link.ingredient_id FROM recipes_ingredientinrecipe AS link "
+    "WHERE link.recipe_id = recipe.id ORDER BY link.ingredient_id)",
+    "CREATE INDEX recipe_ingredient_ids_idx "
+    "ON recipes_recipe USING gin (ingredient_ids)",
+)
+DROP_SQL = (
+    'DROP INDEX IF EXISTS recipe_ingredient_ids_idx',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS ingredient_ids',
+)
+
+
+def create_sets(apps, schema_editor):
+    """
+    Массив id ингредиентов с GIN-индексом поддерживается только
+    PostgreSQL, поэтому столбец создаётся SQL-запросом вне модели.
+    """
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in CREATE_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_sets(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in DROP_SQL:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sets, drop_sets),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.16 on 2026-10-18 05:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_similar_recipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingRecipe',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('score', models.FloatField(verbose_name='Популярность')),
+            ],
+            options={
+                'verbose_name': 'Популярный рецепт',
+                'verbose_name_plural': 'Популярные рецепты',
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingRefresh',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateTimeField(null=True, verbose_name='Учтены добавления до')),
+                ('refreshed', models.DateTimeField(auto_now=True, verbose_name='Дата пересчёта')),
+            ],
+            options={
+                'verbose_name': 'Пересчёт популярности',
+                'verbose_name_plural': 'Пересчёты популярности',
+            },
+        ),
+        migrations.AddField(
+            model_name='favorite',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['created'], name='favorite_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['created'], name='shopping_cart_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingrecipe',
+            index=models.Index(fields=['-score'], name='trending_score_idx'),
+        ),
+    ]
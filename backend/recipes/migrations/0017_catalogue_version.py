@@ -0,0 +1,24 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_trending_recipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочников',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+    ]
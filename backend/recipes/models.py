@@ -1,8 +1,12 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
 from django.db.models import UniqueConstraint
+from django.utils import timezone
+
+from users.counters import CounterQuerySet
 
 User = get_user_model()
 
@@ -24,6 +28,11 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient'),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -60,35 +69,17 @@ class Tag(models.Model):
         return self.name
 
 
-class IngredientInRecipe(models.Model):
-    '''Модель для связи рецепта и ингредиентов.'''
-    ingredient = models.ForeignKey(
-        Ingredient,
-        on_delete=models.CASCADE,
-        related_name='ingredient_list',
-        verbose_name='Ингредиенты в рецепте',
-    )
-    amount = models.IntegerField(
-        default=1,
-        verbose_name='Количество',
-        validators=[
-            MinValueValidator(
-                1, 'В рецепте должен быть как минимум один ингредиент.'
-            )
-        ]
-    )
+class CatalogueVersion(models.Model):
+    '''
+    Версия справочников тегов и ингредиентов. Хранится в базе, чтобы
+    изменения из команд загрузки и из любого воркера видели все
+    процессы, а ETag справочников совпадали между воркерами.
+    '''
+    version = models.BigIntegerField(verbose_name='Версия')
 
     class Meta:
-        verbose_name = 'Ингредиент в рецепте'
-        verbose_name_plural = 'Ингредиенты в рецепте'
-        constraints = [
-            UniqueConstraint(
-                fields=('ingredient', 'amount'),
-                name='unique_ingredient_in_recipe'),
-        ]
-
-    def __str__(self):
-        return f'{self.ingredient} – {self.amount}'
+        verbose_name = 'Версия справочников'
+        verbose_name_plural = 'Версии справочников'
 
 
 class Recipe(models.Model):
@@ -107,15 +98,22 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/images',
     )
+    image_thumb = models.ImageField(
+        verbose_name='Миниатюра изображения',
+        upload_to=settings.RECIPE_IMAGE_VARIANTS_DIR,
+        blank=True,
+        editable=False,
+    )
+    image_medium = models.ImageField(
+        verbose_name='Изображение среднего размера',
+        upload_to=settings.RECIPE_IMAGE_VARIANTS_DIR,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
         max_length=settings.RECIPES_MAX_LENGTH,
     )
-    ingredients = models.ManyToManyField(
-        IngredientInRecipe,
-        related_name='recipes',
-        verbose_name='Ингредиенты в рецепте',
-    )
     tags = models.ManyToManyField(
         Tag,
         related_name='recipes',
@@ -133,16 +131,83 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    # На PostgreSQL у таблицы есть ещё столбец ingredient_ids bigint[]
+    # с GIN-индексом (миграция 0012): отсортированные id ингредиентов
+    # рецепта для фильтров по ингредиентам. В модели его нет, так как
+    # ArrayField не работает на SQLite; столбец читается через RawSQL
+    # и обновляется update_ingredient_sets в recipes.search.
+
+    COUNTERS = (('author', 'recipes_count'),)
+
+    objects = CounterQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
 
+class IngredientInRecipe(models.Model):
+    '''Модель для связи рецепта и ингредиентов.'''
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='ingredients',
+        verbose_name='Рецепт',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='ingredient_list',
+        verbose_name='Ингредиенты в рецепте',
+    )
+    amount = models.IntegerField(
+        default=1,
+        verbose_name='Количество',
+        validators=[
+            MinValueValidator(
+                1, 'В рецепте должен быть как минимум один ингредиент.'
+            )
+        ]
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в рецепте'
+        verbose_name_plural = 'Ингредиенты в рецепте'
+        constraints = [
+            UniqueConstraint(
+                fields=('recipe', 'ingredient'),
+                name='unique_ingredient_in_recipe'),
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} – {self.amount}'
+
+
 class Favorite(models.Model):
     '''Модель для избранных рецептов.'''
     user = models.ForeignKey(
@@ -157,6 +222,14 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Избранный рецепт'
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now,
+    )
+
+    COUNTERS = (('recipe', 'favorites_count'),)
+
+    objects = CounterQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Избранный рецепт'
@@ -168,6 +241,9 @@ class Favorite(models.Model):
                 name='unique_favourites',
             )
         ]
+        indexes = [
+            models.Index(fields=('created',), name='favorite_created_idx'),
+        ]
 
     def __str__(self):
         return (f'{self.user.username} добавил '
@@ -188,6 +264,14 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField(
+        verbose_name='Дата добавления',
+        default=timezone.now,
+    )
+
+    COUNTERS = (('recipe', 'shopping_cart_count'),)
+
+    objects = CounterQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт в списке покупок'
@@ -198,7 +282,132 @@ class ShoppingCart(models.Model):
                 name='unique_shopping_cart'
             )
         ]
+        indexes = [
+            models.Index(fields=('created',),
+                         name='shopping_cart_created_idx'),
+        ]
 
     def __str__(self):
         return (f'{self.user.username} добавил '
                 f'{self.recipe.name} в список покупок')
+
+
+class FeedEntry(models.Model):
+    '''
+    Рецепт в ленте подписчика. Записи создаются при публикации
+    рецепта, pub_date копируется из рецепта для выборки ленты
+    по индексу без обращения к рецептам.
+    '''
+    user = models.ForeignKey(
+        User,
+        related_name='feed',
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = [
+            UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            )
+        ]
+        indexes = [
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='feed_user_pub_date_idx'),
+            models.Index(fields=('user', 'author'),
+                         name='feed_user_author_idx'),
+        ]
+
+
+class SimilarRecipe(models.Model):
+    '''
+    Заранее найденный похожий рецепт: соседи рецепта по косинусной
+    близости векторов ингредиентов и тегов.
+    '''
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(verbose_name='Близость')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            UniqueConstraint(
+                fields=('recipe', 'similar'),
+                name='unique_similar_recipe',
+            )
+        ]
+        indexes = [
+            models.Index(fields=('recipe', '-score'),
+                         name='similar_recipe_score_idx'),
+        ]
+
+
+class TrendingRecipe(models.Model):
+    '''
+    Популярность рецепта: сумма весов добавлений в избранное
+    и в списки покупок с экспоненциальным затуханием. Хранится
+    логарифм суммы, приведённой к началу отсчёта recipes.trending,
+    поэтому порядок рецептов со временем не меняется и записи
+    обновляются только при новых добавлениях.
+    '''
+    recipe = models.OneToOneField(
+        Recipe,
+        primary_key=True,
+        related_name='trending',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField(verbose_name='Популярность')
+
+    class Meta:
+        verbose_name = 'Популярный рецепт'
+        verbose_name_plural = 'Популярные рецепты'
+        indexes = [
+            models.Index(fields=('-score',), name='trending_score_idx'),
+        ]
+
+
+class TrendingRefresh(models.Model):
+    '''
+    Состояние пересчёта популярности: добавления не позже watermark
+    уже учтены в TrendingRecipe.
+    '''
+    watermark = models.DateTimeField(
+        verbose_name='Учтены добавления до',
+        null=True,
+    )
+    refreshed = models.DateTimeField(
+        verbose_name='Дата пересчёта',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Пересчёт популярности'
+        verbose_name_plural = 'Пересчёты популярности'
@@ -0,0 +1,183 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import (BooleanField, Count, Exists, F, IntegerField,
+                              OuterRef, Subquery)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import IngredientInRecipe
+
+FTS_TABLE = 'recipes_recipe_fts'
+WORD_RE = re.compile(r'\w+')
+INGREDIENT_NAMES_SQL = (
+    "SELECT {aggregate} FROM recipes_ingredientinrecipe AS link "
+    "JOIN recipes_ingredient AS ingredient "
+    "ON ingredient.id = link.ingredient_id "
+    "WHERE link.recipe_id = recipe.id"
+)
+YO_SQL = "replace(replace({}, 'ё', 'е'), 'Ё', 'Е')"
+UPDATE_SQL = {
+    'postgresql': (
+        "UPDATE recipes_recipe AS recipe SET search_vector = "
+        "setweight(to_tsvector(%s::regconfig, recipe.name), 'A') || "
+        "setweight(to_tsvector(%s::regconfig, recipe.text), 'B') || "
+        "setweight(to_tsvector(%s::regconfig, coalesce(("
+        + INGREDIENT_NAMES_SQL.format(
+            aggregate="string_agg(ingredient.name, ' ')")
+        + "), '')), 'C') {where}"
+    ),
+    'sqlite': (
+        f"INSERT INTO {FTS_TABLE} (rowid, name, text, ingredients) "
+        "SELECT recipe.id, "
+        + YO_SQL.format('recipe.name') + ", "
+        + YO_SQL.format('recipe.text') + ", "
+        + YO_SQL.format('(' + INGREDIENT_NAMES_SQL.format(
+            aggregate="group_concat(ingredient.name, ' ')") + ')')
+        + " FROM recipes_recipe AS recipe {where}"
+    ),
+}
+UPDATE_INGREDIENT_SETS_SQL = (
+    "UPDATE recipes_recipe AS recipe SET ingredient_ids = array("
+    "SELECT link.ingredient_id FROM recipes_ingredientinrecipe AS link "
+    "WHERE link.recipe_id = recipe.id ORDER BY link.ingredient_id) {where}"
+)
+
+
+def normalize(text):
+    """Приводит текст к нижнему регистру и заменяет «ё» на «е»."""
+    return text.casefold().replace('ё', 'е')
+
+
+def get_where(recipe_ids):
+    """Условие WHERE и параметры для выборки рецептов recipe_ids."""
+    if recipe_ids is None:
+        return '', []
+    ids = list(recipe_ids)
+    return f'WHERE recipe.id IN ({", ".join(["%s"] * len(ids))})', ids
+
+
+def update_ingredient_sets(recipe_ids=None, using=None):
+    """Пересчитывает массивы id ингредиентов рецептов."""
+    using = using or connection
+    where, ids = get_where(recipe_ids)
+    if using.vendor != 'postgresql' or recipe_ids is not None and not ids:
+        return
+    with using.cursor() as cursor:
+        cursor.execute(UPDATE_INGREDIENT_SETS_SQL.format(where=where), ids)
+
+
+def update_search_index(recipe_ids=None, using=None):
+    """
+    Обновляет поисковый индекс для рецептов recipe_ids
+    или для всех рецептов, если они не заданы.
+    """
+    using = using or connection
+    where, ids = get_where(recipe_ids)
+    if using.vendor not in UPDATE_SQL or recipe_ids is not None and not ids:
+        return
+    with using.cursor() as cursor:
+        if using.vendor == 'sqlite':
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} '
+                + where.replace('recipe.id', 'rowid'), ids)
+            cursor.execute(UPDATE_SQL['sqlite'].format(where=where), ids)
+        else:
+            cursor.execute(
+                UPDATE_SQL['postgresql'].format(where=where),
+                [settings.RECIPE_SEARCH_CONFIG] * 3 + ids)
+
+
+def search_recipes(queryset, query):
+    """
+    Оставляет рецепты, подходящие под запрос, и сортирует их
+    по релевантности: сначала совпадения в названии, затем в описании
+    и в ингредиентах.
+    """
+    words = WORD_RE.findall(normalize(query))
+    if not words:
+        return queryset
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(query, config=settings.RECIPE_SEARCH_CONFIG,
+                                   search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-rank', '-pub_date')
+    if connection.vendor == 'sqlite':
+        # FTS5 не умеет стемминг для русского, поэтому каждое слово
+        # ищется как префикс. bm25() доступна только в запросе
+        # с MATCH, поэтому таблица FTS5 присоединяется через extra().
+        match = ' AND '.join(f'"{word}"*' for word in words)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = recipes_recipe.id',
+                   f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'rank': f'-bm25({FTS_TABLE}, 10.0, 4.0, 1.0)'},
+        ).order_by('-rank', '-pub_date')
+    for word in words:
+        queryset = queryset.filter(name__icontains=word)
+    return queryset
+
+
+def contains_ingredients(ingredient_ids):
+    """Подзапрос: в рецепте есть хотя бы один из ингредиентов."""
+    return Exists(IngredientInRecipe.objects.filter(
+        recipe=OuterRef('pk'), ingredient_id__in=ingredient_ids))
+
+
+def filter_by_ingredients(queryset, include=(), exclude=()):
+    """
+    Оставляет рецепты со всеми ингредиентами include и без единого
+    ингредиента exclude. На PostgreSQL проверяется массив id
+    ингредиентов по GIN-индексу, на остальных СУБД - подзапросы EXISTS
+    по уникальному индексу (рецепт, ингредиент).
+    """
+    include, exclude = list(include), list(exclude)
+    if connection.vendor == 'postgresql':
+        if include:
+            queryset = queryset.alias(has_all=RawSQL(
+                'recipes_recipe.ingredient_ids @> %s::bigint[]',
+                (include,), output_field=BooleanField(),
+            )).filter(has_all=True)
+        if exclude:
+            queryset = queryset.alias(has_any=RawSQL(
+                'recipes_recipe.ingredient_ids && %s::bigint[]',
+                (exclude,), output_field=BooleanField(),
+            )).filter(has_any=False)
+        return queryset
+    for ingredient_id in include:
+        queryset = queryset.filter(contains_ingredients([ingredient_id]))
+    if exclude:
+        queryset = queryset.filter(~contains_ingredients(exclude))
+    return queryset
+
+
+def rank_by_pantry(queryset, pantry):
+    """
+    Оставляет рецепты, в которых есть хотя бы один продукт из pantry,
+    и сортирует их по числу использованных продуктов.
+    """
+    pantry = list(pantry)
+    if connection.vendor == 'postgresql':
+        queryset = queryset.alias(has_any=RawSQL(
+            'recipes_recipe.ingredient_ids && %s::bigint[]',
+            (pantry,), output_field=BooleanField(),
+        )).filter(has_any=True).annotate(pantry_matches=RawSQL(
+            'cardinality(array(SELECT unnest(recipes_recipe.ingredient_ids) '
+            'INTERSECT SELECT unnest(%s::bigint[])))',
+            (pantry,), output_field=IntegerField(),
+        ))
+    else:
+        queryset = queryset.filter(
+            contains_ingredients(pantry)
+        ).annotate(pantry_matches=Coalesce(Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk'), ingredient_id__in=pantry,
+            ).order_by().values('recipe').annotate(
+                count=Count('pk')).values('count'),
+            output_field=IntegerField(),
+        ), 0))
+    return queryset.order_by('-pantry_matches', '-pub_date')
@@ -0,0 +1,265 @@
+import heapq
+import logging
+import math
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count
+
+from .models import IngredientInRecipe, Recipe, SimilarRecipe
+
+logger = logging.getLogger(__name__)
+
+TAGS = Recipe.tags.through
+
+executor = (ThreadPoolExecutor(max_workers=settings.SIMILAR_WORKERS,
+                               thread_name_prefix='similar-recipes')
+            if settings.SIMILAR_WORKERS else None)
+
+# Векторы и индекс для процессов build_similar_recipes.
+worker_vectors = {}
+worker_index = {}
+
+
+def get_features(recipe_ids=None):
+    """
+    Множества признаков рецептов {id рецепта: {признак, ...}}:
+    id ингредиентов и id тегов со знаком минус.
+    """
+    ingredients = IngredientInRecipe.objects.values_list(
+        'recipe_id', 'ingredient_id')
+    tags = TAGS.objects.values_list('recipe_id', 'tag_id')
+    if recipe_ids is not None:
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    features = defaultdict(set)
+    for recipe_id, ingredient_id in ingredients.iterator():
+        features[recipe_id].add(ingredient_id)
+    for recipe_id, tag_id in tags.iterator():
+        features[recipe_id].add(-tag_id)
+    return features
+
+
+def count_features(features):
+    """Число рецептов с каждым из признаков features по базе."""
+    ingredient_ids = [feature for feature in features if feature > 0]
+    tag_ids = [-feature for feature in features if feature < 0]
+    counts = dict(IngredientInRecipe.objects.filter(
+        ingredient_id__in=ingredient_ids,
+    ).values('ingredient_id').annotate(count=Count('id')).values_list(
+        'ingredient_id', 'count'))
+    counts.update(
+        (-tag_id, count) for tag_id, count in TAGS.objects.filter(
+            tag_id__in=tag_ids,
+        ).values('tag_id').annotate(count=Count('id')).values_list(
+            'tag_id', 'count'))
+    return counts
+
+
+def vectorize(features, counts, total):
+    """
+    Нормированный вектор TF-IDF рецепта. Ингредиент либо есть
+    в рецепте, либо нет, поэтому вес признака - его IDF; теги
+    дополнительно умножаются на SIMILAR_TAG_WEIGHT.
+    """
+    vector = {}
+    for feature in features:
+        weight = math.log((1 + total) / (1 + counts.get(feature, 0))) + 1
+        if feature < 0:
+            weight *= settings.SIMILAR_TAG_WEIGHT
+        vector[feature] = weight
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    return {feature: weight / norm for feature, weight in vector.items()}
+
+
+def get_candidate_features(vector, counts, total):
+    """
+    Признаки, по которым ищутся кандидаты в соседи. Признаки,
+    встречающиеся чаще чем в доле SIMILAR_MAX_DF рецептов и чем
+    в SIMILAR_MAX_CANDIDATES рецептах (соль, теги), дают мало для
+    близости и слишком много кандидатов, поэтому учитываются только
+    при подсчёте близости.
+    """
+    limit = max(settings.SIMILAR_MAX_DF * total,
+                settings.SIMILAR_MAX_CANDIDATES)
+    rare = [feature for feature in vector if counts.get(feature, 0) <= limit]
+    if rare or not vector:
+        return rare
+    return [min(vector, key=lambda feature: counts.get(feature, 0))]
+
+
+def build_index(vectors, counts, total):
+    """Обратный индекс: {признак: [id рецептов]} по редким признакам."""
+    index = defaultdict(list)
+    for recipe_id, vector in vectors.items():
+        for feature in get_candidate_features(vector, counts, total):
+            index[feature].append(recipe_id)
+    return index
+
+
+def similarity(first, second):
+    if len(first) > len(second):
+        first, second = second, first
+    return sum(weight * second.get(feature, 0)
+               for feature, weight in first.items())
+
+
+def nearest(recipe_id, vectors, index):
+    """SIMILAR_RECIPES_LIMIT ближайших рецептов: [(близость, id)]."""
+    vector = vectors[recipe_id]
+    candidates = set()
+    for feature in vector:
+        candidates.update(index.get(feature, ()))
+    candidates.discard(recipe_id)
+    return heapq.nlargest(
+        settings.SIMILAR_RECIPES_LIMIT,
+        ((similarity(vector, vectors[candidate]), candidate)
+         for candidate in candidates),
+    )
+
+
+def init_worker(vectors, index):
+    worker_vectors.update(vectors)
+    worker_index.update(index)
+
+
+def find_neighbours(recipe_ids):
+    """Соседи пачки рецептов в процессе пула."""
+    return [(recipe_id, nearest(recipe_id, worker_vectors, worker_index))
+            for recipe_id in recipe_ids]
+
+
+def prepare():
+    """Векторы всех рецептов и обратный индекс для полного пересчёта."""
+    features = get_features()
+    total = Recipe.objects.count()
+    counts = Counter(
+        feature for values in features.values() for feature in values)
+    vectors = {recipe_id: vectorize(values, counts, total)
+               for recipe_id, values in features.items()}
+    return vectors, build_index(vectors, counts, total)
+
+
+def make_rows(recipe_id, neighbours):
+    return [SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for score, similar_id in neighbours if score > 0]
+
+
+def score_candidates(recipe_id):
+    """
+    Близость рецепта к кандидатам в соседи [(близость, id)].
+    Кандидаты - рецепты с общими редкими признаками, не больше
+    SIMILAR_MAX_CANDIDATES с наибольшим числом общих признаков.
+    """
+    features = get_features([recipe_id]).get(recipe_id)
+    if not features:
+        return []
+    total = Recipe.objects.count()
+    counts = count_features(features)
+    vector = vectorize(features, counts, total)
+    rare = get_candidate_features(vector, counts, total)
+    shared = Counter(IngredientInRecipe.objects.filter(
+        ingredient_id__in=[feature for feature in rare if feature > 0],
+    ).values_list('recipe_id', flat=True).iterator())
+    shared.update(TAGS.objects.filter(
+        tag_id__in=[-feature for feature in rare if feature < 0],
+    ).values_list('recipe_id', flat=True).iterator())
+    shared.pop(recipe_id, None)
+    candidates = get_features([
+        candidate for candidate, _ in shared.most_common(
+            settings.SIMILAR_MAX_CANDIDATES)])
+    counts.update(count_features(
+        set().union(*candidates.values()) - set(counts)))
+    return [
+        (similarity(vector, vectorize(values, counts, total)), candidate)
+        for candidate, values in candidates.items()
+    ]
+
+
+def replace_neighbours(recipe_id, scores):
+    SimilarRecipe.objects.filter(recipe_id=recipe_id).delete()
+    SimilarRecipe.objects.bulk_create(make_rows(
+        recipe_id, heapq.nlargest(settings.SIMILAR_RECIPES_LIMIT, scores)),
+        ignore_conflicts=True)
+
+
+@transaction.atomic
+def update_similar(recipe_id):
+    """
+    Пересчитывает соседей рецепта после сохранения и добавляет его
+    в списки соседей рецептов, которым он ближе их последнего соседа.
+    Списки, из которых рецепт выбыл, пересчитываются заново, чтобы
+    в них снова было SIMILAR_RECIPES_LIMIT соседей.
+    """
+    affected = set(SimilarRecipe.objects.filter(
+        similar_id=recipe_id).values_list('recipe_id', flat=True))
+    SimilarRecipe.objects.filter(similar_id=recipe_id).delete()
+    scores = score_candidates(recipe_id)
+    replace_neighbours(recipe_id, scores)
+    refill_similar(affected - add_reverse_neighbours(recipe_id, scores))
+
+
+@transaction.atomic
+def refill_similar(recipe_ids):
+    """Пересчитывает соседей рецептов, например после удаления соседа."""
+    for recipe_id in recipe_ids:
+        replace_neighbours(recipe_id, score_candidates(recipe_id))
+
+
+def add_reverse_neighbours(recipe_id, scores):
+    """
+    Добавляет рецепт в списки соседей кандидатов, которым он ближе
+    их последнего соседа. Возвращает id этих кандидатов.
+    """
+    limit = settings.SIMILAR_RECIPES_LIMIT
+    lists = defaultdict(list)
+    for row in SimilarRecipe.objects.filter(
+            recipe_id__in=[candidate for _, candidate in scores]).only(
+                'id', 'recipe_id', 'score'):
+        lists[row.recipe_id].append(row)
+    rows = []
+    stale = []
+    for score, candidate in scores:
+        neighbours = sorted(lists[candidate], key=lambda row: -row.score)
+        if score <= 0 or len(neighbours) >= limit and (
+                neighbours[limit - 1].score >= score):
+            continue
+        rows.append(SimilarRecipe(
+            recipe_id=candidate, similar_id=recipe_id, score=score))
+        stale.extend(row.id for row in neighbours[limit - 1:])
+    SimilarRecipe.objects.filter(id__in=stale).delete()
+    SimilarRecipe.objects.bulk_create(rows, ignore_conflicts=True)
+    return {row.recipe_id for row in rows}
+
+
+def process_similar(function, *args):
+    """Пересчитывает соседей; ошибка записывается в журнал."""
+    try:
+        function(*args)
+    except Exception:
+        logger.exception('Не удалось пересчитать похожие рецепты %s', args)
+
+
+def process_similar_in_background(function, *args):
+    """Пересчитывает соседей в фоновом потоке."""
+    try:
+        process_similar(function, *args)
+    finally:
+        close_old_connections()
+
+
+def schedule_similar(function, *args):
+    """
+    Пересчитывает соседей после фиксации транзакции, когда ингредиенты
+    и теги сохранены: в фоновом потоке или, с SIMILAR_WORKERS=0,
+    в самом запросе.
+    """
+    if executor is None:
+        transaction.on_commit(lambda: process_similar(function, *args))
+    else:
+        transaction.on_commit(
+            lambda: executor.submit(process_similar_in_background, function,
+                                    *args))
@@ -0,0 +1,117 @@
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Favorite, ShoppingCart, TrendingRecipe, TrendingRefresh
+
+# Начало отсчёта: вклад добавления в момент t равен
+# вес * 2 ** ((t - EPOCH) / TRENDING_HALF_LIFE), сравнение таких сумм
+# равносильно сравнению сумм, затухших к текущему моменту.
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def get_weights():
+    return ((Favorite, settings.TRENDING_FAVORITE_WEIGHT),
+            (ShoppingCart, settings.TRENDING_SHOPPING_CART_WEIGHT))
+
+
+def get_decay():
+    return math.log(2) / settings.TRENDING_HALF_LIFE
+
+
+def log_score(created, weight):
+    """Логарифм вклада добавления, сделанного в момент created."""
+    return math.log(weight) + get_decay() * (
+        created - EPOCH).total_seconds()
+
+
+def log_add(first, second):
+    """log(exp(first) + exp(second)) без переполнения."""
+    if first < second:
+        first, second = second, first
+    return first + math.log1p(math.exp(second - first))
+
+
+def get_min_score(now):
+    """Порог, ниже которого рецепты выбывают из популярных."""
+    return log_score(now, settings.TRENDING_MIN_SCORE)
+
+
+@transaction.atomic
+def refresh_trending(full=False):
+    """
+    Учитывает добавления, сделанные после прошлого пересчёта и раньше
+    чем TRENDING_REFRESH_LAG секунд назад (более поздние транзакции
+    могут быть ещё не зафиксированы), и убирает рецепты, популярность
+    которых затухла ниже TRENDING_MIN_SCORE. С full=True популярность
+    считается заново по всем добавлениям. Возвращает число
+    учтённых добавлений.
+    """
+    state, _ = TrendingRefresh.objects.select_for_update().get_or_create(
+        pk=1)
+    if full:
+        TrendingRecipe.objects.all().delete()
+        state.watermark = None
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.TRENDING_REFRESH_LAG)
+    scores = {}
+    events = 0
+    for model, weight in get_weights():
+        rows = model.objects.filter(created__lte=cutoff)
+        if state.watermark is not None:
+            rows = rows.filter(created__gt=state.watermark)
+        for recipe_id, created in rows.values_list(
+                'recipe_id', 'created').iterator():
+            score = log_score(created, weight)
+            if recipe_id in scores:
+                score = log_add(scores[recipe_id], score)
+            scores[recipe_id] = score
+            events += 1
+    existing = TrendingRecipe.objects.in_bulk(list(scores))
+    for row in existing.values():
+        row.score = log_add(row.score, scores[row.pk])
+    TrendingRecipe.objects.bulk_update(
+        existing.values(), ('score',),
+        batch_size=settings.TRENDING_BATCH_SIZE)
+    TrendingRecipe.objects.bulk_create(
+        [TrendingRecipe(recipe_id=recipe_id, score=score)
+         for recipe_id, score in scores.items()
+         if recipe_id not in existing],
+        batch_size=settings.TRENDING_BATCH_SIZE,
+    )
+    TrendingRecipe.objects.filter(score__lt=get_min_score(now)).delete()
+    state.watermark = cutoff
+    state.save()
+    return events
+
+
+@transaction.atomic
+def remove_trending(model, rows):
+    """
+    Вычитает вклад удалённых добавлений (пар рецепт, created), если
+    он уже учтён, чтобы повторные добавления и удаления не поднимали
+    рецепты.
+    """
+    state = TrendingRefresh.objects.filter(pk=1).first()
+    if state is None or state.watermark is None:
+        return
+    weight = dict(get_weights())[model]
+    scores = {}
+    for recipe_id, created in rows:
+        if created > state.watermark:
+            continue
+        score = log_score(created, weight)
+        if recipe_id in scores:
+            score = log_add(scores[recipe_id], score)
+        scores[recipe_id] = score
+    for row in TrendingRecipe.objects.select_for_update().filter(
+            recipe_id__in=list(scores)):
+        score = scores[row.pk]
+        if score >= row.score:
+            row.delete()
+            continue
+        row.score += math.log1p(-math.exp(score - row.score))
+        row.save(update_fields=('score',))
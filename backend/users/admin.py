@@ -14,7 +14,7 @@ class BaseAdminSettings(admin.ModelAdmin):
 class UserAdmin(UserAdmin):
     """Кастомизация админ панели - управление пользователями."""
     list_display = ('id', 'email', 'username', 'first_name', 'last_name',
-                    'password')
+                    'password', 'recipes_count', 'followers_count')
     list_filter = ('username', 'email')
 
 
@@ -0,0 +1,61 @@
+from django.db import models
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def get_counters(model):
+    """Пары (внешний ключ, поле счётчика) у связанной модели."""
+    return [(model._meta.get_field(field), counter)
+            for field, counter in model.COUNTERS]
+
+
+def change_counters(instance, delta):
+    """Атомарно изменяет счётчики объектов, на которые ссылается строка."""
+    for field, counter in get_counters(type(instance)):
+        queryset = field.related_model.objects.filter(
+            pk=getattr(instance, field.attname))
+        if delta < 0:
+            queryset = queryset.filter(**{f'{counter}__gte': -delta})
+        queryset.update(**{counter: F(counter) + delta})
+
+
+def get_count_subquery(model, field):
+    """Подзапрос с числом строк model, ссылающихся на внешний объект."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field.name: OuterRef('pk')})
+        .order_by().values(field.name)
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def recount(model, pks=None, drifted_only=False):
+    """
+    Пересчитывает счётчики строк model у связанных объектов.
+    Возвращает число исправленных объектов.
+    """
+    updated = 0
+    for field, counter in get_counters(model):
+        targets = field.related_model.objects.all()
+        if pks is not None:
+            targets = targets.filter(pk__in=pks.get(field.name, ()))
+        count = get_count_subquery(model, field)
+        if drifted_only:
+            targets = targets.alias(actual=count).filter(
+                ~Q(**{counter: F('actual')}))
+        updated += targets.update(**{counter: count})
+    return updated
+
+
+class CounterQuerySet(models.QuerySet):
+    """
+    QuerySet для моделей со счётчиками у связанных объектов.
+    bulk_create не отправляет сигналы, поэтому затронутые счётчики
+    пересчитываются одним запросом на каждый счётчик.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        pks = {field.name: {getattr(obj, field.attname) for obj in objs}
+               for field, _ in get_counters(self.model)}
+        recount(self.model, pks)
+        return objs
@@ -2,6 +2,8 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .counters import CounterQuerySet
+
 
 class User(AbstractUser):
     """Модель пользователей."""
@@ -37,6 +39,16 @@ class User(AbstractUser):
         verbose_name='Пароль',
         max_length=settings.USERS_MAX_LENGTH
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -68,6 +80,10 @@ class Subscribe(models.Model):
         verbose_name='Автор'
     )
 
+    COUNTERS = (('author', 'followers_count'),)
+
+    objects = CounterQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -1,7 +1,8 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from .views import CustomUserViewSet
+from .views import CustomUserViewSet, JWTCreateView
 
 app_name = 'users'
 
@@ -14,3 +15,10 @@ urlpatterns = [
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
 ]
+
+if settings.JWT_AUTH:
+    urlpatterns += [
+        re_path(r'^auth/jwt/create/?$', JWTCreateView.as_view(),
+                name='jwt-create'),
+        path('auth/', include('djoser.urls.jwt')),
+    ]
@@ -1,31 +1,90 @@
-from api.pagination import CustomPagination
-from api.serializers import SubscribeListSerializer, SubscribeSerializer
+from collections import defaultdict
+
+from api.pagination import (CursorPaginationMixin, CustomPagination,
+                            SubscriptionCursorPagination)
+from api.serializers import (JWTCreateSerializer, SubscribeListSerializer,
+                             SubscribeSerializer, get_recipes_limit)
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import BooleanField, F, Value, Window
+from django.db.models.functions import RowNumber
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework_simplejwt.views import TokenObtainPairView
+
+from recipes.models import Recipe
 
 User = get_user_model()
 
+PREVIEW_FIELDS = ('id', 'name', 'image', 'image_thumb', 'image_medium',
+                  'cooking_time', 'author')
+PREVIEWS_SQL = (
+    'SELECT recipe.* FROM unnest(%s::bigint[]) AS author(id) '
+    'CROSS JOIN LATERAL ('
+    'SELECT id, name, image, image_thumb, image_medium, cooking_time, '
+    f'author_id FROM {Recipe._meta.db_table} '
+    'WHERE author_id = author.id '
+    'ORDER BY pub_date DESC, id DESC LIMIT %s'
+    ') AS recipe'
+)
+
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
     """Вьюсет для кастомной модели пользователя."""
     permission_classes = (IsAuthenticated,)
     pagination_class = CustomPagination
     serializer_class = SubscribeListSerializer
 
-    @action(['GET'], detail=False)
+    def add_recipe_previews(self, authors, recipes_limit):
+        """
+        Загружает последние рецепты всех авторов страницы одним запросом.
+        В PostgreSQL рецепты каждого автора выбираются LATERAL-подзапросом
+        с LIMIT по индексу (author, pub_date, id), и читаются только
+        recipes_limit строк на автора; в остальных базах рецепты
+        нумеруются внутри автора через ROW_NUMBER().
+        """
+        recipes = Recipe.objects.filter(author__in=authors).only(
+            *PREVIEW_FIELDS)
+        if recipes_limit is not None and connection.vendor == 'postgresql':
+            recipes = Recipe.objects.raw(
+                PREVIEWS_SQL, ([author.id for author in authors],
+                               recipes_limit))
+        elif recipes_limit is not None:
+            sql, params = recipes.annotate(row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )).query.sql_with_params()
+            recipes = Recipe.objects.raw(
+                f'SELECT * FROM ({sql}) AS ranked '
+                f'WHERE row_number <= %s ORDER BY row_number',
+                (*params, recipes_limit),
+            )
+        previews = defaultdict(list)
+        for recipe in recipes:
+            previews[recipe.author_id].append(recipe)
+        for author in authors:
+            author.recipe_previews = previews[author.id]
+
+    @action(['GET'], detail=False,
+            cursor_pagination_class=SubscriptionCursorPagination)
     def subscriptions(self, request):
-        queryset = self.get_queryset().filter(following__user=request.user)
+        recipes_limit = get_recipes_limit(request)
+        queryset = self.get_queryset().filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('username')
         page = self.paginate_queryset(queryset)
+        authors = list(queryset) if page is None else page
+        self.add_recipe_previews(authors, recipes_limit)
+        serializer = self.get_serializer(
+            authors, many=True, context={'request': request})
         if page is not None:
-            serializer = self.get_serializer(
-                page, many=True, context={'request': request})
             return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(
-            queryset, many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(['POST', 'DELETE'], detail=True)
@@ -47,3 +106,8 @@ class CustomUserViewSet(UserViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         self.get_object().following.filter(user=request.user).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class JWTCreateView(TokenObtainPairView):
+    """Выдача JWT по email и паролю."""
+    serializer_class = JWTCreateSerializer